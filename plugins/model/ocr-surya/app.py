@@ -1,34 +1,71 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import asyncio
 import base64
+import bisect
+import hashlib
 import io
+import itertools
 import json
 import logging
 import os
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 import torch
 import uvicorn
-from fastapi import FastAPI, HTTPException, Security
+from fastapi import FastAPI, File, Form, HTTPException, Security, UploadFile
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from PIL import Image, ImageFile
+from PIL import Image
 from pydantic import BaseModel
 from surya.model.detection.model import load_model as load_det_model
 from surya.model.detection.model import load_processor as load_det_processor
 from surya.model.recognition.model import load_model as load_rec_model
 from surya.model.recognition.processor import load_processor as load_rec_processor
-from surya.ocr import run_ocr
-from surya.schema import OCRResult
+from surya.detection import batch_text_detection
+from surya.input.processing import convert_if_not_rgb, slice_polys_from_image
+from surya.postprocessing.text import sort_text_lines
+from surya.recognition import batch_recognition
+from surya.schema import OCRResult, TextDetectionResult, TextLine
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="transformers")
 app = FastAPI()
 security = HTTPBearer()
 env_bearer_token = None
 
+# 跨请求合批：第一张图片到达后最多等待的毫秒数
+OCR_BATCH_MAX_WAIT_MS = float(os.getenv("OCR_BATCH_MAX_WAIT_MS", "10"))
+# 单次送入识别模型的最大图片数
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", "32"))
+# 单次送入检测模型的最大图片数。取值较小时多页请求会被切成多个检测批次，后续批次的检测才能与前一批的识别重叠
+OCR_DET_BATCH_IMAGES = int(os.getenv("OCR_DET_BATCH_IMAGES", "4"))
+# 检测与识别之间最多积压的检测批次数，积压满时检测暂停
+OCR_PIPELINE_DEPTH = int(os.getenv("OCR_PIPELINE_DEPTH", "2"))
+# 图片解码线程数
+OCR_DECODE_WORKERS = int(os.getenv("OCR_DECODE_WORKERS", "4"))
+# 图片最长边超过该值时在检测前等比缩小，0 表示不缩放
+OCR_MAX_IMAGE_SIDE = int(os.getenv("OCR_MAX_IMAGE_SIDE", "2560"))
+# 阅读顺序排序：识别出的每一栏至少占页宽的比例，否则按单栏处理，避免把表格的各列拆开阅读
+OCR_COLUMN_MIN_WIDTH = float(os.getenv("OCR_COLUMN_MIN_WIDTH", "0.2"))
+# 识别结果缓存：内存上限（MB，0 表示关闭缓存）、持久化目录（为空则不落盘）与磁盘上限（MB）
+OCR_CACHE_MB = float(os.getenv("OCR_CACHE_MB", "64"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "")
+OCR_CACHE_DISK_MB = float(os.getenv("OCR_CACHE_DISK_MB", "1024"))
+# 显存占用（reserved / total）超过该比例时才回收显存
+OCR_GC_THRESHOLD = float(os.getenv("OCR_GC_THRESHOLD", "0.8"))
+
+decode_executor = ThreadPoolExecutor(max_workers=OCR_DECODE_WORKERS, thread_name_prefix="decode")
+
 
 # GPU显存回收
 def torch_gc():
     if torch.cuda.is_available():  # 检查是否可用CUDA
+        # 每次回收都会让下一批重新向驱动申请显存，只在显存紧张时回收
+        total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        if torch.cuda.memory_reserved() < total * OCR_GC_THRESHOLD:
+            return
         torch.cuda.empty_cache()  # 清空CUDA缓存
         torch.cuda.ipc_collect()  # 收集CUDA内存碎片
 
@@ -36,6 +73,8 @@ def torch_gc():
 class ImageReq(BaseModel):
     images: List[str]
     sorted: Optional[bool] = False
+    # 额外返回带坐标的文本行
+    structured: Optional[bool] = False
 
 
 class Singleton(type):
@@ -58,90 +97,495 @@ class Surya(metaclass=Singleton):
         self.rec_model, self.rec_processor = load_rec_model(
         ), load_rec_processor()
 
-    def run(self, image: ImageFile.ImageFile) -> List[OCRResult]:
-        predictions = run_ocr([image], [self.langs], self.det_model,
-                              self.det_processor, self.rec_model,
-                              self.rec_processor, self.batch_size)
+    def detect(self, images: List[Image.Image]) -> List[TextDetectionResult]:
+        return batch_text_detection(convert_if_not_rgb(images), self.det_model, self.det_processor)
+
+    def recognize(self, images: List[Image.Image],
+                  det_predictions: List[TextDetectionResult]) -> List[OCRResult]:
+        """按检测结果切出文本行并识别，与 run_ocr 检测之后的部分一致。"""
+        slices, slice_counts = [], []
+        for image, det_pred in zip(convert_if_not_rgb(images), det_predictions):
+            image_slices = slice_polys_from_image(image, [box.polygon for box in det_pred.bboxes])
+            slice_counts.append(len(image_slices))
+            slices.extend(image_slices)
+        texts, confidences = batch_recognition(slices, [self.langs] * len(slices), self.rec_model,
+                                               self.rec_processor, batch_size=self.batch_size)
+        predictions = []
+        start = 0
+        for det_pred, count in zip(det_predictions, slice_counts):
+            lines = [TextLine(text=text, polygon=box.polygon, bbox=box.bbox, confidence=confidence)
+                     for text, confidence, box in zip(texts[start:start + count],
+                                                      confidences[start:start + count], det_pred.bboxes)]
+            start += count
+            predictions.append(OCRResult(text_lines=sort_text_lines(lines), languages=self.langs,
+                                         image_bbox=det_pred.image_bbox))
         return predictions
 
 
-class Chat(object):
+class Page(object):
+    """一张图片的识别结果，以及排序与坐标换算需要的检测时图片宽度和原图尺寸。"""
 
-    def __init__(self):
-        self.surya = Surya()
+    def __init__(self, result: OCRResult, width: int, original_size):
+        self.result = result
+        self.width = width
+        self.original_size = tuple(original_size)
 
-    def base64_to_image(base64_string: str) -> ImageFile.ImageFile:
-        image_data = base64.b64decode(base64_string)
-        image_stream = io.BytesIO(image_data)
-        image = Image.open(image_stream)
-        return image
+    def dumps(self) -> str:
+        return json.dumps({"result": self.result.model_dump(), "width": self.width,
+                           "original_size": self.original_size}, ensure_ascii=False)
 
-    def sort_text_by_bbox(original_data: List[dict]) -> str:
-        # 根据bbox进行排序，从左到右，从上到下。返回排序后的按行的字符串。
-        # 排序
-        lines, line = [], []
-        original_data.sort(key=lambda item: item["bbox"][1])
-        for item in original_data:
-            mid_h = (item["bbox"][1] + item["bbox"][3]) / 2
-            if len(line) == 0 or (mid_h >= line[0]["bbox"][1]
-                                  and mid_h <= line[0]["bbox"][3]):
-                line.append(item)
-            else:
-                lines.append(line)
-                line = [item]
-        lines.append(line)
-        for line in lines:
-            line.sort(key=lambda item: item["bbox"][0])
-        # 构建行字符串
-        string_result = ""
-        for line in lines:
-            for item in line:
-                string_result += item["text"] + " "
-            string_result += "\n"
-        return string_result
-
-    def query_ocr(self, image_base64: str,
-                  sorted: bool) -> str:
-        if image_base64 is None or len(image_base64) == 0:
-            return ""
+    @staticmethod
+    def loads(payload: str) -> "Page":
+        data = json.loads(payload)
+        return Page(OCRResult.model_validate(data["result"]), data["width"], data["original_size"])
+
+
+class OcrCache(metaclass=Singleton):
+    """
+    以图片内容哈希为键的识别结果缓存，键中包含识别语言与缩放配置。内存中按序列化后的大小做 LRU 淘汰；
+    配置 OCR_CACHE_DIR 时同时写入磁盘，重启后沿用，磁盘同样按大小上限淘汰最久未用的文件。
+    """
+
+    def __init__(self, max_mb: float = OCR_CACHE_MB, directory: str = OCR_CACHE_DIR,
+                 max_disk_mb: float = OCR_CACHE_DISK_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self.directory = directory if self.enabled else ""
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            # 按修改时间恢复 LRU 顺序
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime, name[:-5], stat.st_size))
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_bytes += size
+
+    @staticmethod
+    def key(data: Union[bytes, BinaryIO], langs: List[str]) -> str:
+        """按图片内容与识别配置计算缓存键。上传文件分块哈希后回到开头，不整体读入内存。"""
+        if isinstance(data, bytes):
+            digest = hashlib.blake2b(data, digest_size=16)
+        else:
+            digest = hashlib.blake2b(digest_size=16)
+            for chunk in iter(lambda: data.read(1024 * 1024), b""):
+                digest.update(chunk)
+            data.seek(0)
+        digest.update(json.dumps([langs, OCR_MAX_IMAGE_SIDE]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[Page]:
+        if not self.enabled:
+            return None
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None:
+                self.memory.move_to_end(key)
+                return item[0]
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                payload = f.read()
+            page = Page.loads(payload)
+            os.utime(self.path(key))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"读取 OCR 缓存失败: {e}")
+            return None
+        self._remember(key, page, len(payload))
+        return page
+
+    def _remember(self, key: str, page: Page, size: int):
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key)[1]
+            self.memory[key] = (page, size)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_bytes:
+                _, (_, old_size) = self.memory.popitem(last=False)
+                self.memory_bytes -= old_size
+
+    def put(self, key: str, page: Page):
+        if not self.enabled:
+            return
+        payload = page.dumps()
+        self._remember(key, page, len(payload))
+        if not self.directory:
+            return
+        tmp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
         try:
-            image = Chat.base64_to_image(image_base64)
-            ocr_result = self.surya.run(image)
-            result = []
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path(key))
+            size = os.path.getsize(self.path(key))
+        except OSError as e:
+            logging.warning(f"写入 OCR 缓存失败: {e}")
+            return
+        removed = []
+        with self.lock:
+            self.disk_bytes -= self.disk.pop(key, 0)
+            self.disk[key] = size
+            self.disk_bytes += size
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, old_size = self.disk.popitem(last=False)
+                self.disk_bytes -= old_size
+                removed.append(old_key)
+        for old_key in removed:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
 
-            for text_line in ocr_result[0].text_lines:
-                result.append(text_line.text)
+class OcrBatcher(metaclass=Singleton):
+    """
+    跨请求合批的两级流水线：检测与识别各有一个工作线程，中间是有界队列。检测阶段在等待窗口内
+    凑满一个检测批次，结果放入队列后立即开始下一批；识别阶段每次取出队列中已积压的全部批次合成一批。
+    多页请求中第 N+1 页的检测与第 N 页的识别同时进行，总耗时接近 max(检测, 识别)。
+    """
 
-            if sorted:
-                result = self.sort_text_lines(result)
+    def __init__(self, max_wait_ms: float = OCR_BATCH_MAX_WAIT_MS,
+                 max_images: int = OCR_BATCH_MAX_IMAGES, det_images: int = OCR_DET_BATCH_IMAGES,
+                 depth: int = OCR_PIPELINE_DEPTH):
+        self.surya = Surya()
+        self.max_wait = max_wait_ms / 1000
+        self.max_images = max(1, max_images)
+        self.det_images = max(1, det_images)
+        self.depth = max(1, depth)
+        self.det_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr_det")
+        self.rec_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr_rec")
+        self.pending = []
+        self.arrival = None
+        self.detected = None
+        self.workers = []
 
-            # 将所有文本行合并成一个字符串，用换行符分隔
-            final_result = "\n".join(result)
+    async def recognize(self, images: List[Image.Image]) -> List[OCRResult]:
+        if len(images) == 0:
+            return []
+        loop = asyncio.get_running_loop()
+        if len(self.workers) == 0 or any(worker.done() for worker in self.workers):
+            for worker in self.workers:
+                worker.cancel()
+            self.arrival = asyncio.Event()
+            self.detected = asyncio.Queue(maxsize=self.depth)
+            self.workers = [loop.create_task(self._detect_worker()), loop.create_task(self._recognize_worker())]
+        futures = []
+        for image in images:
+            future = loop.create_future()
+            self.pending.append((image, future))
+            futures.append(future)
+        self.arrival.set()
+        return await asyncio.gather(*futures)
 
+    def _detect(self, images: List[Image.Image]) -> List[TextDetectionResult]:
+        try:
+            return self.surya.detect(images)
+        finally:
             torch_gc()
-            return final_result
+
+    def _recognize(self, images: List[Image.Image],
+                   det_predictions: List[TextDetectionResult]) -> List[OCRResult]:
+        try:
+            return self.surya.recognize(images, det_predictions)
+        finally:
+            torch_gc()
+
+    @staticmethod
+    def _fail(batch, e: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+
+    async def _detect_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self.pending) == 0:
+                self.arrival.clear()
+                await self.arrival.wait()
+                continue
+            deadline = loop.time() + self.max_wait
+            while len(self.pending) < self.det_images:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self.arrival.clear()
+                try:
+                    await asyncio.wait_for(self.arrival.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch = [item for item in self.pending[:self.det_images] if not item[1].done()]
+            self.pending = self.pending[self.det_images:]
+            if len(batch) == 0:
+                continue
+            try:
+                det_predictions = await loop.run_in_executor(
+                    self.det_executor, self._detect, [image for image, _ in batch])
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+            # 队列满时在这里等待，识别跟不上时不再继续检测
+            await self.detected.put((batch, det_predictions))
+
+    async def _recognize_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch, det_predictions = await self.detected.get()
+            batch, det_predictions = list(batch), list(det_predictions)
+            # 合并已经检测完、在队列中等待的批次
+            while not self.detected.empty() and len(batch) < self.max_images:
+                more, more_predictions = self.detected.get_nowait()
+                batch.extend(more)
+                det_predictions.extend(more_predictions)
+            try:
+                predictions = await loop.run_in_executor(
+                    self.rec_executor, self._recognize, [image for image, _ in batch], det_predictions)
+            except Exception as e:
+                self._fail(batch, e)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+
+class Chat(object):
+
+    def __init__(self):
+        self.batcher = OcrBatcher()
+        self.cache = OcrCache()
+
+    def read_source(self, source: Union[str, BinaryIO]) -> Tuple[str, Union[bytes, BinaryIO]]:
+        """返回缓存键与图片数据：base64 字符串解码为字节，上传文件直接使用文件对象，由 PIL 从中读取。"""
+        data = base64.b64decode(source) if isinstance(source, str) else source
+        return OcrCache.key(data, self.batcher.surya.langs), data
+
+    def lookup(self, key: str, data: Union[bytes, BinaryIO]) -> Union[Page, Image.Image]:
+        """命中缓存时返回识别结果，否则解码图片。"""
+        page = self.cache.get(key)
+        if page is not None:
+            return page
+        return Chat.load_image(data)
+
+    @staticmethod
+    def load_image(data: Union[bytes, BinaryIO]) -> Image.Image:
+        """解码图片，超大的图片缩小到 OCR_MAX_IMAGE_SIDE 以内。"""
+        image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+        original_size = image.size
+        scale = OCR_MAX_IMAGE_SIDE / max(image.size) if OCR_MAX_IMAGE_SIDE > 0 else 1
+        if scale < 1:
+            # JPEG 可以在解码时直接按 1/2、1/4、1/8 缩小，省掉大部分解码时间
+            image.draft("RGB", (round(image.width * scale), round(image.height * scale)))
+        # Image.open 是惰性的，在解码线程中完成像素解码
+        image = image.convert("RGB")
+        if scale < 1:
+            image.thumbnail((OCR_MAX_IMAGE_SIDE, OCR_MAX_IMAGE_SIDE))
+        image.info["original_size"] = original_size
+        return image
+
+    async def query_ocr(self, sources: List[Union[str, BinaryIO]],
+                        sorted: bool) -> Tuple[List[str], List[List[dict]]]:
+        """返回每张图片的文本，以及按输出顺序排列、坐标对应原图的文本行。"""
+        # 空图片直接返回空字符串，其余图片并行读取、按内容去重并查缓存，未命中的解码后整体送入合批队列
+        indexes = [index for index, source in enumerate(sources) if source]
+        final_results = [""] * len(sources)
+        final_lines = [[] for _ in sources]
+        try:
+            loop = asyncio.get_running_loop()
+            keyed = await asyncio.gather(*[
+                loop.run_in_executor(decode_executor, self.read_source, sources[index])
+                for index in indexes])
+            unique = {}
+            for key, data in keyed:
+                unique.setdefault(key, data)
+            items = await asyncio.gather(*[
+                loop.run_in_executor(decode_executor, self.lookup, key, data)
+                for key, data in unique.items()])
+            pages = {}
+            misses = []
+            for key, item in zip(unique, items):
+                if isinstance(item, Page):
+                    pages[key] = item
+                else:
+                    misses.append((key, item))
+            ocr_results = await self.batcher.recognize([image for _, image in misses])
+            for (key, image), ocr_result in zip(misses, ocr_results):
+                pages[key] = Page(ocr_result, image.width, image.info.get("original_size", image.size))
+            await asyncio.gather(*[
+                loop.run_in_executor(decode_executor, self.cache.put, key, pages[key])
+                for key, _ in misses])
+
+            for index, (key, _) in zip(indexes, keyed):
+                page = pages[key]
+                ocr_result = page.result
+                if sorted:
+                    rows = self.sort_text_lines(ocr_result.text_lines, page.width)
+                else:
+                    rows = [[text_line] for text_line in ocr_result.text_lines]
+
+                # 同一行内的文本用空格连接，各行之间用换行符分隔
+                final_results[index] = "\n".join(
+                    " ".join(text_line.text for text_line in row) for row in rows)
+                # 检测前缩小过的图片，坐标换算回原图
+                scale = page.original_size[0] / page.width
+                final_lines[index] = [{
+                    "text": text_line.text,
+                    "bbox": [round(value * scale, 1) for value in text_line.bbox],
+                    "confidence": text_line.confidence,
+                    "row": row_index,
+                } for row_index, row in enumerate(rows) for text_line in row]
+            return final_results, final_lines
         except Exception as e:
             logging.error(f"OCR 处理失败: {e}")
             raise HTTPException(status_code=400, detail=f"OCR 处理失败: {str(e)}")
 
     @staticmethod
-    def sort_text_lines(text_lines: List[str]) -> List[str]:
-        # 这里可以实现自定义的排序逻辑
-        # 目前只是简单地返回原始列表，因为我们没有位置信息来进行排序
-        return text_lines
+    def sort_text_lines(text_lines: List[TextLine],
+                        page_width: float) -> List[List[TextLine]]:
+        """
+        按阅读顺序排列文本行，返回按行分组的结果。先找出页面的栏间距，跨过栏间距的行（标题等）视为通栏行，
+        按通栏行把页面切成上下若干段，段内按 x 区间合并识别分栏，各栏从左到右、栏内从上到下按行扫描，行内从左到右。
+        每一步都是排序加一次线性扫描，整体 O(n log n)。
+        """
+        if len(text_lines) == 0:
+            return []
+        gutters = Chat.find_gutters(text_lines, page_width)
+        gutter_ends = [end for _, end in gutters]
+        text_lines = sorted(text_lines, key=lambda line: (line.bbox[1], line.bbox[0]))
+        bands, band, spanning = [], [], None
+        for text_line in text_lines:
+            # 第一个右边界在行左边界之后的栏间距，若其左边界也在行右边界之前，则该行跨过了栏间距
+            index = bisect.bisect_right(gutter_ends, text_line.bbox[0])
+            is_spanning = index < len(gutters) and gutters[index][0] < text_line.bbox[2]
+            if len(band) > 0 and is_spanning != spanning:
+                # 同一行被拆成多个框时，与通栏行处于同一行的框随通栏行一起排序，避免把这一行拆开
+                if is_spanning:
+                    split = len(band)
+                    while split > 0 and Chat.same_row(band[split - 1], text_line):
+                        split -= 1
+                    if split > 0:
+                        bands.append((spanning, band[:split]))
+                    band = band[split:]
+                elif Chat.same_row(band[-1], text_line):
+                    band.append(text_line)
+                    continue
+                else:
+                    bands.append((spanning, band))
+                    band = []
+            band.append(text_line)
+            spanning = is_spanning
+        bands.append((spanning, band))
 
-@app.post('/v1/ocr/text')
-async def handle_post_request(
-    image_req: ImageReq,
-    credentials: HTTPAuthorizationCredentials = Security(security)):
+        rows = []
+        for spanning, band in bands:
+            columns = [band] if spanning else Chat.split_columns(band, page_width)
+            for column in columns:
+                rows.extend(Chat.group_rows(column))
+        return rows
+
+    @staticmethod
+    def find_gutters(text_lines: List[TextLine],
+                     page_width: float) -> List[Tuple[float, float]]:
+        """
+        返回页面的栏间距 (左边界, 右边界)，按 x 排序。扫描每个 x 位置被多少行覆盖，覆盖数比左右两侧都低的区间为候选，
+        两侧完全落在区间外的行各自构成一栏，栏宽不小于 OCR_COLUMN_MIN_WIDTH，且跨过该区间的行比任一栏的行都少时，
+        该区间才是栏间距。跨栏的标题无论宽窄都只会让覆盖数略高于 0，不影响识别。
+        """
+        events = sorted([(line.bbox[0], 1) for line in text_lines] + [(line.bbox[2], -1) for line in text_lines])
+        # 覆盖数相同的相邻区间合并，segments 中每项为 [左边界, 右边界, 覆盖数]
+        segments, count = [], 0
+        for (x, delta), (next_x, _) in zip(events, events[1:]):
+            count += delta
+            if next_x <= x:
+                continue
+            if len(segments) > 0 and segments[-1][2] == count and segments[-1][1] == x:
+                segments[-1][1] = next_x
+            else:
+                segments.append([x, next_x, count])
+
+        # 按右边界排序的行，前缀上取左边界的最小值；按左边界排序的行，后缀上取右边界的最大值，用于求两侧的栏宽
+        by_end = sorted(text_lines, key=lambda line: line.bbox[2])
+        ends = [line.bbox[2] for line in by_end]
+        left_starts = list(itertools.accumulate((line.bbox[0] for line in by_end), min))
+        by_start = sorted(text_lines, key=lambda line: line.bbox[0])
+        starts = [line.bbox[0] for line in by_start]
+        right_ends = list(itertools.accumulate((line.bbox[2] for line in reversed(by_start)), max))[::-1]
+
+        gutters = []
+        for previous, segment, following in zip(segments, segments[1:], segments[2:]):
+            start, end, crossing = segment
+            if crossing >= previous[2] or crossing >= following[2]:
+                continue
+            left = bisect.bisect_right(ends, start)
+            right = len(starts) - bisect.bisect_left(starts, end)
+            if crossing >= min(left, right):
+                continue
+            if (start - left_starts[left - 1] < page_width * OCR_COLUMN_MIN_WIDTH
+                    or right_ends[-right] - end < page_width * OCR_COLUMN_MIN_WIDTH):
+                continue
+            gutters.append((start, end))
+        return gutters
+
+    @staticmethod
+    def split_columns(text_lines: List[TextLine],
+                      page_width: float) -> List[List[TextLine]]:
+        # 按左边界排序后合并相互重叠的 x 区间，区间之间的空白即为栏间距
+        spans = []
+        for text_line in sorted(text_lines, key=lambda line: line.bbox[0]):
+            if len(spans) > 0 and text_line.bbox[0] <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], text_line.bbox[2])
+                spans[-1][2].append(text_line)
+            else:
+                spans.append([text_line.bbox[0], text_line.bbox[2], [text_line]])
+        if len(spans) == 1 or any(end - start < page_width * OCR_COLUMN_MIN_WIDTH
+                                  for start, end, _ in spans):
+            return [text_lines]
+        return [column for _, _, column in spans]
+
+    @staticmethod
+    def same_row(a: TextLine, b: TextLine) -> bool:
+        # 任一文本框的垂直中心落在另一个的上下边界内即视为同一行
+        return (a.bbox[1] <= (b.bbox[1] + b.bbox[3]) / 2 <= a.bbox[3]
+                or b.bbox[1] <= (a.bbox[1] + a.bbox[3]) / 2 <= b.bbox[3])
+
+    @staticmethod
+    def group_rows(text_lines: List[TextLine]) -> List[List[TextLine]]:
+        # 按垂直中心排序，中心落在当前行首个文本框上下边界内的归入同一行
+        rows, top, bottom = [], None, None
+        for text_line in sorted(text_lines, key=lambda line: (line.bbox[1] + line.bbox[3]) / 2):
+            middle = (text_line.bbox[1] + text_line.bbox[3]) / 2
+            if len(rows) > 0 and top <= middle <= bottom:
+                rows[-1].append(text_line)
+            else:
+                rows.append([text_line])
+                top, bottom = text_line.bbox[1], text_line.bbox[3]
+        for row in rows:
+            row.sort(key=lambda line: line.bbox[0])
+        return rows
+
+def check_token(credentials: HTTPAuthorizationCredentials):
     token = credentials.credentials
     if env_bearer_token is not None and token != env_bearer_token:
         raise HTTPException(status_code=401, detail="无效的令牌")
+
+
+async def recognize(sources: List[Union[str, BinaryIO]], sorted: bool,
+                    structured: bool = False):
     chat = Chat()
     try:
-        results = []
-        for image_base64 in image_req.images:
-            results.append(chat.query_ocr(image_base64, image_req.sorted))
+        results, lines = await chat.query_ocr(sources, sorted)
+        if structured:
+            return {"error": None, "results": results, "lines": lines}
         return {"error": None, "results": results}
     except HTTPException as he:
         raise he
@@ -149,6 +593,25 @@ async def handle_post_request(
         logging.error(f"识别报错：{e}")
         raise HTTPException(status_code=500, detail=f"识别出错: {str(e)}")
 
+
+@app.post('/v1/ocr/text')
+async def handle_post_request(
+    image_req: ImageReq,
+    credentials: HTTPAuthorizationCredentials = Security(security)):
+    check_token(credentials)
+    return await recognize(image_req.images, image_req.sorted, image_req.structured)
+
+
+@app.post('/v1/ocr/file')
+async def handle_file_request(
+    files: List[UploadFile] = File(...),
+    sorted: bool = Form(False),
+    structured: bool = Form(False),
+    credentials: HTTPAuthorizationCredentials = Security(security)):
+    # 直接上传图片文件，省去 base64 的体积膨胀与编解码，返回格式与 /v1/ocr/text 相同
+    check_token(credentials)
+    return await recognize([upload.file for upload in files], sorted, structured)
+
 if __name__ == "__main__":
     env_bearer_token = os.getenv("ACCESS_TOKEN")
     try:
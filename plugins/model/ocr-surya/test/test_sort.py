@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+阅读顺序排序（sorted=true）的用例，只用到排序逻辑，不加载模型。
+
+cd plugins/model/ocr-surya && python -m pytest test
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("surya")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from surya.schema import TextLine  # noqa: E402
+
+from app import Chat  # noqa: E402
+
+PAGE_WIDTH = 1000
+
+
+def line(text, x0, y0, x1, y1):
+    return TextLine(polygon=[[x0, y0], [x1, y0], [x1, y1], [x0, y1]], text=text, bbox=[x0, y0, x1, y1])
+
+
+def two_columns(top=100, rows=3):
+    lines = []
+    for i in range(rows):
+        lines.append(line(f"left{i}", 50, top + i * 30, 470, top + 20 + i * 30))
+        lines.append(line(f"right{i}", 530, top + 2 + i * 30, 950, top + 22 + i * 30))
+    return lines
+
+
+def read(lines):
+    return [" ".join(text_line.text for text_line in row) for row in Chat.sort_text_lines(lines, PAGE_WIDTH)]
+
+
+def test_wide_title_and_footer():
+    lines = [line("Title", 100, 20, 900, 60)] + two_columns() + [line("Footer", 50, 300, 950, 320)]
+    assert read(lines[::-1]) == ["Title", "left0", "left1", "left2", "right0", "right1", "right2", "Footer"]
+
+
+def test_narrow_centered_title_crossing_gutter():
+    # 标题只占页宽的 40%，但跨过了两栏之间的空白，不能把两栏合并成一栏交错读取
+    lines = [line("Title", 300, 20, 700, 60)] + two_columns()
+    assert read(lines) == ["Title", "left0", "left1", "left2", "right0", "right1", "right2"]
+
+
+def test_narrow_heading_between_column_sections():
+    lines = two_columns(top=100) + [line("Section", 350, 200, 650, 230)] + two_columns(top=250)
+    assert read(lines) == ["left0", "left1", "left2", "right0", "right1", "right2", "Section",
+                           "left0", "left1", "left2", "right0", "right1", "right2"]
+
+
+def test_single_column():
+    lines = [line("Heading", 400, 10, 600, 40)]
+    lines += [line(f"p{i}", 50, 60 + 30 * i, 950 - 37 * i, 80 + 30 * i) for i in range(10)]
+    lines.append(line("3", 900, 400, 950, 420))
+    assert read(lines) == ["Heading"] + [f"p{i}" for i in range(10)] + ["3"]
+
+
+def test_table_rows_stay_together():
+    lines = two_columns() + [line("Footer", 50, 300, 950, 320)]
+    for i in range(2):
+        lines += [line(f"k{i}", 50, 400 + i * 30, 150, 420 + i * 30),
+                  line(f"v{i}", 300, 401 + i * 30, 380, 421 + i * 30),
+                  line(f"w{i}", 600, 399 + i * 30, 700, 419 + i * 30)]
+    # 同一行被拆成两个框，后一个框跨过栏间距
+    lines += [line("Hello", 50, 500, 300, 520), line("world", 320, 503, 600, 523)]
+    assert read(lines)[-3:] == ["k0 v0 w0", "k1 v1 w1", "Hello world"]
@@ -0,0 +1,704 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time: 2023/11/7 22:45
+@Author: zhidong
+@File: reranker.py
+@Desc:
+"""
+import os
+import asyncio
+import collections
+import contextlib
+import gc
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+import torch
+import logging
+import uvicorn
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Security, HTTPException
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from FlagEmbedding import FlagReranker
+from transformers import AutoTokenizer
+from pydantic import Field, BaseModel, validator
+from typing import Optional, List
+
+app = FastAPI()
+security = HTTPBearer()
+env_bearer_token = 'ACCESS_TOKEN'
+
+class QADocs(BaseModel):
+    model: Optional[str] = None
+    query: Optional[str]
+    documents: Optional[List[str]]
+    # 只返回分数最高的 top_n 条 / 只返回分数不低于阈值的文档
+    top_n: Optional[int] = Field(None, ge=1)
+    score_threshold: Optional[float] = None
+    # 两阶段重排：先用 BM25 从全部文档中选出 prefilter_k 条，再交给模型打分
+    prefilter_k: Optional[int] = Field(None, ge=1)
+
+
+class Singleton(type):
+    def __call__(cls, *args, **kwargs):
+        if not hasattr(cls, '_instance'):
+            cls._instance = super().__call__(*args, **kwargs)
+        return cls._instance
+
+
+# 模型目录：默认加载 RERANK_MODEL_DIR 下所有包含 config.json 的子目录，目录名即模型名。
+# 也可以用 RERANK_MODELS 指定，格式为逗号分隔的目录名，或 {"模型名": "模型路径"} 形式的 JSON
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+RERANK_MODELS = os.getenv("RERANK_MODELS")
+# 请求中的 model 未注册时使用的模型，默认取第一个
+RERANK_DEFAULT_MODEL = os.getenv("RERANK_DEFAULT_MODEL")
+# 模型闲置多少秒后卸载（0 表示不按闲置卸载），以及已加载模型权重的总大小上限（MB，0 表示不限制）
+RERANK_MODEL_IDLE_SECONDS = float(os.getenv("RERANK_MODEL_IDLE_SECONDS", "0"))
+RERANK_MEMORY_BUDGET_MB = float(os.getenv("RERANK_MEMORY_BUDGET_MB", "0"))
+# 所有模型共享的推理线程数
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "1"))
+# 推理后端：torch 或 onnx。onnx 需先用 export_onnx.py 导出，默认使用动态 int8 量化后的模型
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch")
+RERANK_ONNX_FILE = os.getenv("RERANK_ONNX_FILE", "model_quantized.onnx")
+RERANK_ONNX_THREADS = int(os.getenv("RERANK_ONNX_THREADS", "0"))
+# 合批窗口：第一个请求到达后最多等待的毫秒数，以及单次前向计算的最大 pair 数
+RERANK_MAX_WAIT_MS = float(os.getenv("RERANK_MAX_WAIT_MS", "5"))
+RERANK_MAX_BATCH_PAIRS = int(os.getenv("RERANK_MAX_BATCH_PAIRS", "256"))
+# 单个前向批次的 token 预算（batch 大小 * 批内最长序列长度），以及单个 pair 的最大 token 数
+RERANK_MAX_BATCH_TOKENS = int(os.getenv("RERANK_MAX_BATCH_TOKENS", "16384"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+# 分数缓存：进程内 LRU 条数上限（0 表示关闭），以及可选的多 worker 共享 SQLite 文件和其条数上限
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "100000"))
+RERANK_CACHE_DB = os.getenv("RERANK_CACHE_DB")
+RERANK_CACHE_DB_SIZE = int(os.getenv("RERANK_CACHE_DB_SIZE", "1000000"))
+# 请求未指定 prefilter_k 时的默认 BM25 预筛选条数，0 表示不预筛选
+RERANK_PREFILTER_K = int(os.getenv("RERANK_PREFILTER_K", "0"))
+
+class TorchBackend(object):
+    """FlagReranker 加载的 PyTorch 模型。"""
+
+    def __init__(self, model_path: str):
+        self.reranker = FlagReranker(model_path, use_fp16=False)
+        self.tokenizer = self.reranker.tokenizer
+
+    @staticmethod
+    def weight_files(model_path: str) -> List[str]:
+        # 模型仓库常同时带有 safetensors 与 bin 两份权重，实际只会加载一份
+        files = os.listdir(model_path) if os.path.isdir(model_path) else []
+        safetensors = [file for file in files if file.endswith(".safetensors")]
+        weights = safetensors or [file for file in files if file.endswith((".bin", ".pt"))]
+        return [os.path.join(model_path, file) for file in weights]
+
+    @torch.no_grad()
+    def logits(self, features: List[dict]) -> List[float]:
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors='pt').to(self.reranker.device)
+        return self.reranker.model(**inputs, return_dict=True).logits.view(-1, ).float().cpu().numpy().tolist()
+
+
+class OnnxBackend(object):
+    """ONNX Runtime CPU 推理，模型由 export_onnx.py 导出到 模型目录/onnx/。"""
+
+    def __init__(self, model_path: str, onnx_file: str = RERANK_ONNX_FILE):
+        import onnxruntime
+
+        onnx_path = OnnxBackend.weight_files(model_path, onnx_file)[0]
+        if not os.path.isfile(onnx_path):
+            raise FileNotFoundError(f"未找到 {onnx_path}，请先运行 python export_onnx.py 导出模型")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        options = onnxruntime.SessionOptions()
+        if RERANK_ONNX_THREADS > 0:
+            options.intra_op_num_threads = RERANK_ONNX_THREADS
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+
+    @staticmethod
+    def weight_files(model_path: str, onnx_file: str = RERANK_ONNX_FILE) -> List[str]:
+        return [os.path.join(model_path, "onnx", onnx_file)]
+
+    def logits(self, features: List[dict]) -> List[float]:
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors='np')
+        feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0].reshape(-1).astype(np.float32).tolist()
+
+
+BACKENDS = {"torch": TorchBackend, "onnx": OnnxBackend}
+
+
+class ReRanker(object):
+    def __init__(self, model_path, max_batch_tokens: int = RERANK_MAX_BATCH_TOKENS,
+                 max_length: int = RERANK_MAX_LENGTH, backend: str = RERANK_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的推理后端 {backend}，可选：{', '.join(BACKENDS)}")
+        self.backend = BACKENDS[backend](model_path)
+        # 快速 tokenizer 不能被多个线程同时调用，共享 tokenizer 的模型共用同一把锁
+        self.tokenizer_lock = threading.Lock()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+
+    def compute_score(self, pairs: List[List[str]]):
+        if len(pairs) > 0:
+            return self.compute_score_bucketed(pairs)
+        else:
+            return None
+
+    def pack_batches(self, lengths: List[int]) -> List[List[int]]:
+        """按 token 长度降序排列后装箱，每批补齐后的 token 数不超过预算，返回每批的原始下标。"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+        batches, batch = [], []
+        for index in order:
+            # 降序排列，批内第一个就是最长的，补齐后的总量即 批大小 * 首个长度
+            if len(batch) > 0 and (len(batch) + 1) * lengths[batch[0]] > self.max_batch_tokens:
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def compute_score_bucketed(self, pairs: List[List[str]]) -> List[float]:
+        # 只分词一次，不做 padding，按批再补齐到批内最长
+        with self.tokenizer_lock:
+            features = self.backend.tokenizer(pairs, truncation=True, max_length=self.max_length)
+        lengths = [len(ids) for ids in features["input_ids"]]
+        scores = [0.0] * len(pairs)
+        for batch in self.pack_batches(lengths):
+            logits = self.backend.logits([{key: features[key][index] for key in features.keys()} for index in batch])
+            for index, logit in zip(batch, logits):
+                scores[index] = float(1 / (1 + np.exp(-logit)))
+        return scores
+
+class BM25(object):
+    """基于单个请求内文档构建的轻量 BM25，用于在模型打分前筛掉明显不相关的候选。"""
+
+    TOKEN_PATTERN = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+")
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [collections.Counter(BM25.tokenize(doc)) for doc in documents]
+        self.doc_lens = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avg_len = sum(self.doc_lens) / max(len(documents), 1) or 1
+        doc_freqs = collections.Counter(term for freqs in self.term_freqs for term in freqs)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()}
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        # 英文数字按词切分，中日韩文字没有空格，使用单字加相邻双字
+        tokens = []
+        for run in BM25.TOKEN_PATTERN.findall(text.lower()):
+            if run[0] < "\u0080":
+                tokens.append(run)
+            else:
+                tokens.extend(run)
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        return tokens
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in set(BM25.tokenize(query)) if term in self.idf]
+        scores = []
+        for freqs, doc_len in zip(self.term_freqs, self.doc_lens):
+            norm = self.k1 * (1 - self.b + self.b * doc_len / self.avg_len)
+            score = 0.0
+            for term in terms:
+                tf = freqs.get(term, 0)
+                if tf > 0:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def top_k(self, query: str, k: int) -> List[int]:
+        scores = self.scores(query)
+        return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+
+
+class ScoreCache(metaclass=Singleton):
+    """
+    (query, doc) 分数缓存。key 为 模型名 + 规范化后的 query 和文档 的哈希，
+    进程内为有界 LRU，配置 RERANK_CACHE_DB 后未命中时再查共享的 SQLite。
+    SQLite 的读写都在单独的线程中执行，写入不等待完成，磁盘慢时不会阻塞事件循环。
+    """
+
+    def __init__(self, max_size: int = RERANK_CACHE_SIZE, db_path: Optional[str] = RERANK_CACHE_DB,
+                 db_max_size: int = RERANK_CACHE_DB_SIZE):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        self.db_max_size = db_max_size
+        self.db_writes = 0
+        self.db_executor = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, score REAL, created REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS scores_created ON scores (created)")
+            # 连接只在这一个线程里使用，读写按提交顺序执行
+            self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank_cache")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 or self.db is not None
+
+    @staticmethod
+    def make_key(model_name: str, query: str, doc: str) -> str:
+        text = "\x00".join([model_name, " ".join(query.split()), " ".join(doc.split())])
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[float]]:
+        scores = [None] * len(keys)
+        missing = []
+        with self.lock:
+            for index, key in enumerate(keys):
+                score = self.entries.get(key)
+                if score is None:
+                    missing.append(index)
+                else:
+                    self.entries.move_to_end(key)
+                    scores[index] = score
+        if self.db is not None and len(missing) > 0:
+            found = await asyncio.get_running_loop().run_in_executor(
+                self.db_executor, self._db_get, [keys[index] for index in missing])
+            still_missing = []
+            with self.lock:
+                for index in missing:
+                    score = found.get(keys[index])
+                    if score is None:
+                        still_missing.append(index)
+                    else:
+                        scores[index] = score
+                        self._put(keys[index], score)
+            missing = still_missing
+        with self.lock:
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+        return scores
+
+    def put_many(self, keys: List[str], scores: List[float]):
+        with self.lock:
+            for key, score in zip(keys, scores):
+                self._put(key, score)
+        if self.db is not None and len(keys) > 0:
+            # 后台写入，进程内 LRU 已经可以命中
+            self.db_executor.submit(self._db_put, list(keys), list(scores))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "shared": self.db is not None,
+            }
+
+    def _put(self, key: str, score: float):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = score
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, keys: List[str]) -> dict:
+        found = {}
+        try:
+            # SQLite 单条语句的变量数有上限，分段查询
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.db.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update(rows.fetchall())
+        except sqlite3.Error as e:
+            logging.warning(f"读取重排缓存失败: {e}")
+        return found
+
+    def _db_put(self, keys: List[str], scores: List[float]):
+        now = time.time()
+        try:
+            self.db.executemany("INSERT OR REPLACE INTO scores (key, score, created) VALUES (?, ?, ?)",
+                                [(key, score, now) for key, score in zip(keys, scores)])
+            self.db_writes += len(keys)
+            # 定期按写入时间淘汰最早的条目，控制文件大小
+            if self.db_writes >= 1000:
+                self.db_writes = 0
+                self.db.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY created "
+                    "LIMIT MAX(0, (SELECT COUNT(*) FROM scores) - ?))", (self.db_max_size, ))
+        except sqlite3.Error as e:
+            logging.warning(f"写入重排缓存失败: {e}")
+
+
+class PendingRerank(object):
+    """一个请求在调度队列中的状态，大请求会被切片后与其他请求轮转合批。"""
+
+    def __init__(self, pairs: List[List[str]], future: asyncio.Future):
+        self.pairs = pairs
+        self.future = future
+        self.scores = [0.0] * len(pairs)
+        self.cursor = 0
+        self.remaining = len(pairs)
+
+
+class BatchScheduler(object):
+    """
+    将并发请求的 (query, doc) 对在一个短窗口内合并，放到工作线程中做一次批量前向计算，
+    再把分数按请求拆分返回，避免同步推理阻塞事件循环。每个模型一个调度器，共享线程池。
+    """
+
+    def __init__(self, reranker: ReRanker, executor: ThreadPoolExecutor,
+                 max_wait_ms: float = RERANK_MAX_WAIT_MS, max_batch_pairs: int = RERANK_MAX_BATCH_PAIRS):
+        self.reranker = reranker
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_pairs = max(1, max_batch_pairs)
+        # 调度协程逐批等待结果，同一模型同一时刻只有一个批次在计算
+        self.executor = executor
+        self.pending = collections.deque()
+        self.queued_pairs = 0
+        self.arrival = None
+        self.worker = None
+
+    async def compute_score(self, pairs: List[List[str]]) -> Optional[List[float]]:
+        if len(pairs) == 0:
+            return None
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(PendingRerank(pairs, future))
+        self.queued_pairs += len(pairs)
+        self.arrival.set()
+        return await future
+
+    @property
+    def idle(self) -> bool:
+        return len(self.pending) == 0
+
+    def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def _ensure_worker(self):
+        # 事件循环由 uvicorn 创建，调度协程在首个请求时懒启动
+        if self.worker is None or self.worker.done():
+            self.arrival = asyncio.Event()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _wait_for_batch(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while self.queued_pairs < self.max_batch_pairs:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self.arrival.clear()
+            try:
+                await asyncio.wait_for(self.arrival.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _take_batch(self) -> List[tuple]:
+        # 轮转地从每个请求取切片，超大请求剩余部分放回队尾，不会饿死后到的小请求
+        batch, size = [], 0
+        for _ in range(len(self.pending)):
+            if size >= self.max_batch_pairs:
+                break
+            item = self.pending.popleft()
+            if item.future.done():
+                self.queued_pairs -= len(item.pairs) - item.cursor
+                continue
+            start = item.cursor
+            end = min(len(item.pairs), start + self.max_batch_pairs - size)
+            item.cursor = end
+            self.queued_pairs -= end - start
+            size += end - start
+            batch.append((item, start, end))
+            if end < len(item.pairs):
+                self.pending.append(item)
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self.pending) == 0:
+                self.arrival.clear()
+                await self.arrival.wait()
+                continue
+            await self._wait_for_batch()
+            batch = self._take_batch()
+            if len(batch) == 0:
+                continue
+            pairs = [pair for item, start, end in batch for pair in item.pairs[start:end]]
+            try:
+                scores = await loop.run_in_executor(self.executor, self.reranker.compute_score, pairs)
+            except Exception as e:
+                for item, start, end in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+            offset = 0
+            for item, start, end in batch:
+                item.scores[start:end] = scores[offset:offset + end - start]
+                offset += end - start
+                item.remaining -= end - start
+                if item.remaining == 0 and not item.future.done():
+                    item.future.set_result(item.scores)
+
+
+class ModelEntry(object):
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.reranker = None
+        self.scheduler = None
+        self.size_bytes = ModelEntry.estimate_size(path)
+        self.last_used = 0.0
+        self.active = 0
+        self.load_lock = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.reranker is not None
+
+    @staticmethod
+    def estimate_size(path: str) -> int:
+        # 以权重文件大小估算加载后的内存占用，加载前即可判断是否超出预算
+        files = BACKENDS.get(RERANK_BACKEND, TorchBackend).weight_files(path)
+        return sum(os.path.getsize(file) for file in files if os.path.isfile(file))
+
+
+class ModelRegistry(metaclass=Singleton):
+    """
+    一个进程内托管多个重排模型，按请求的 model 字段路由。
+    模型在首次请求时加载，按闲置时间和内存预算卸载，推理线程池和相同词表的 tokenizer 在模型间共享。
+    """
+
+    def __init__(self, models: Optional[dict] = None, default_model: Optional[str] = RERANK_DEFAULT_MODEL,
+                 idle_seconds: float = RERANK_MODEL_IDLE_SECONDS,
+                 memory_budget_mb: float = RERANK_MEMORY_BUDGET_MB, workers: int = RERANK_WORKERS):
+        if models is None:
+            models = ModelRegistry.discover_models()
+        if len(models) == 0:
+            raise ValueError(f"未找到重排模型，请将模型放到 {RERANK_MODEL_DIR} 或设置 RERANK_MODELS")
+        self.entries = {name: ModelEntry(name, path) for name, path in models.items()}
+        self.default_model = default_model if default_model in self.entries else next(iter(self.entries))
+        self.idle_seconds = idle_seconds
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="rerank")
+        self.tokenizers = {}
+        self.reaper = None
+
+    @staticmethod
+    def discover_models() -> dict:
+        if RERANK_MODELS:
+            if RERANK_MODELS.strip().startswith("{"):
+                return json.loads(RERANK_MODELS)
+            names = [name.strip() for name in RERANK_MODELS.split(",") if name.strip()]
+            return {name: os.path.join(RERANK_MODEL_DIR, name) for name in names}
+        if not os.path.isdir(RERANK_MODEL_DIR):
+            return {}
+        return {
+            name: os.path.join(RERANK_MODEL_DIR, name)
+            for name in sorted(os.listdir(RERANK_MODEL_DIR))
+            if os.path.isfile(os.path.join(RERANK_MODEL_DIR, name, "config.json"))
+        }
+
+    def resolve(self, name: Optional[str]) -> str:
+        # 原来的单模型服务会忽略 model 字段，未注册的名字回退到默认模型以保持兼容
+        if name in self.entries:
+            return name
+        return self.default_model
+
+    def stats(self) -> dict:
+        return {
+            name: {"loaded": entry.loaded, "size_mb": round(entry.size_bytes / 1024 / 1024, 1),
+                   "active": entry.active}
+            for name, entry in self.entries.items()
+        }
+
+    @contextlib.asynccontextmanager
+    async def use(self, name: str):
+        entry = self.entries[name]
+        entry.active += 1
+        try:
+            self._ensure_reaper()
+            if not entry.loaded:
+                await self._load(entry)
+            entry.last_used = time.monotonic()
+            yield entry
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+
+    async def _load(self, entry: ModelEntry):
+        if entry.load_lock is None:
+            entry.load_lock = asyncio.Lock()
+        async with entry.load_lock:
+            if entry.loaded:
+                return
+            self._evict_for(entry)
+            logging.info(f"加载重排模型 {entry.name}: {entry.path}")
+            loop = asyncio.get_running_loop()
+            entry.reranker = await loop.run_in_executor(self.executor, self._build_reranker, entry.path)
+            entry.scheduler = BatchScheduler(entry.reranker, self.executor)
+
+    def _build_reranker(self, path: str) -> ReRanker:
+        reranker = ReRanker(path)
+        # 词表相同的模型（如 base 与 large）共用同一个 tokenizer 实例及其锁，
+        # RERANK_WORKERS > 1 时不同模型的批次可能在不同线程中同时分词
+        key = ModelRegistry.tokenizer_key(path)
+        if key is not None:
+            tokenizer, lock = self.tokenizers.setdefault(key, (reranker.backend.tokenizer, reranker.tokenizer_lock))
+            reranker.backend.tokenizer = tokenizer
+            reranker.tokenizer_lock = lock
+        return reranker
+
+    @staticmethod
+    def tokenizer_key(path: str) -> Optional[str]:
+        digest = hashlib.sha1()
+        found = False
+        for file in ["tokenizer.json", "sentencepiece.bpe.model", "vocab.txt", "special_tokens_map.json"]:
+            file_path = os.path.join(path, file)
+            if os.path.isfile(file_path):
+                found = True
+                with open(file_path, "rb") as f:
+                    digest.update(file.encode("utf-8"))
+                    digest.update(f.read())
+        return digest.hexdigest() if found else None
+
+    def _evict_for(self, entry: ModelEntry):
+        if self.memory_budget <= 0:
+            return
+        loaded = sorted([e for e in self.entries.values() if e.loaded and e is not entry],
+                        key=lambda e: e.last_used)
+        used = sum(e.size_bytes for e in loaded)
+        for candidate in loaded:
+            if used + entry.size_bytes <= self.memory_budget:
+                break
+            if candidate.active == 0 and candidate.scheduler.idle:
+                used -= candidate.size_bytes
+                self._unload(candidate)
+        if used + entry.size_bytes > self.memory_budget:
+            logging.warning(f"加载 {entry.name} 后将超出内存预算，其余模型仍在使用中")
+
+    def _unload(self, entry: ModelEntry):
+        logging.info(f"卸载重排模型 {entry.name}")
+        entry.scheduler.stop()
+        entry.scheduler = None
+        entry.reranker = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _ensure_reaper(self):
+        if self.idle_seconds > 0 and (self.reaper is None or self.reaper.done()):
+            self.reaper = asyncio.get_running_loop().create_task(self._reap_idle())
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle_seconds / 2, 60))
+            now = time.monotonic()
+            for entry in self.entries.values():
+                if (entry.loaded and entry.active == 0 and entry.scheduler.idle
+                        and now - entry.last_used > self.idle_seconds):
+                    self._unload(entry)
+
+
+class Chat(object):
+    def __init__(self, model_name: Optional[str] = None):
+        self.registry = ModelRegistry()
+        self.model_name = self.registry.resolve(model_name)
+        # 不同后端的分数有细微差别，共享缓存时按后端区分
+        self.cache_name = self.model_name if RERANK_BACKEND == "torch" else f"{self.model_name}@{RERANK_BACKEND}"
+        self.cache = ScoreCache()
+
+    async def schedule(self, pairs: List[List[str]]) -> List[float]:
+        async with self.registry.use(self.model_name) as entry:
+            return await entry.scheduler.compute_score(pairs)
+
+    async def compute_score(self, pairs: List[List[str]]) -> List[float]:
+        # 只有缓存未命中的 pair 才进入合批调度
+        if not self.cache.enabled:
+            return await self.schedule(pairs)
+        keys = [ScoreCache.make_key(self.cache_name, query, doc) for query, doc in pairs]
+        scores = await self.cache.get_many(keys)
+        missing = [index for index, score in enumerate(scores) if score is None]
+        if len(missing) > 0:
+            missing_scores = await self.schedule([pairs[index] for index in missing])
+            for index, score in zip(missing, missing_scores):
+                scores[index] = score
+            self.cache.put_many([keys[index] for index in missing], missing_scores)
+        return scores
+
+    async def fit_query_answer_rerank(self, query_docs: QADocs) -> List:
+        if query_docs is None or len(query_docs.documents) == 0:
+            return []
+
+        candidates = list(range(len(query_docs.documents)))
+        prefilter_k = query_docs.prefilter_k or RERANK_PREFILTER_K
+        if 0 < prefilter_k < len(candidates):
+            candidates = BM25(query_docs.documents).top_k(query_docs.query, prefilter_k)
+
+        pair = [[query_docs.query, query_docs.documents[index]] for index in candidates]
+        scores = await self.compute_score(pair)
+
+        new_docs = []
+        for index, score in zip(candidates, scores):
+            if query_docs.score_threshold is not None and score < query_docs.score_threshold:
+                continue
+            new_docs.append({"index": index, "text": query_docs.documents[index], "score": score})
+        results = [{"index": documents["index"], "relevance_score": documents["score"]} for documents in list(sorted(new_docs, key=lambda x: x["score"], reverse=True))]
+        if query_docs.top_n is not None:
+            results = results[:query_docs.top_n]
+        return results
+
+@app.post('/v1/rerank')
+async def handle_post_request(docs: QADocs, credentials: HTTPAuthorizationCredentials = Security(security)):
+    token = credentials.credentials
+    if env_bearer_token is not None and token != env_bearer_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    chat = Chat(docs.model)
+    try:
+        results = await chat.fit_query_answer_rerank(docs)
+        return {"results": results}
+    except Exception as e:
+        print(f"报错：\n{e}")
+        return {"error": "重排出错"}
+
+@app.get('/v1/rerank/cache')
+async def handle_cache_stats(credentials: HTTPAuthorizationCredentials = Security(security)):
+    token = credentials.credentials
+    if env_bearer_token is not None and token != env_bearer_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return ScoreCache().stats()
+
+@app.get('/v1/models')
+async def handle_models(credentials: HTTPAuthorizationCredentials = Security(security)):
+    token = credentials.credentials
+    if env_bearer_token is not None and token != env_bearer_token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    registry = ModelRegistry()
+    return {"default": registry.default_model, "models": registry.stats()}
+
+if __name__ == "__main__":
+    token = os.getenv("ACCESS_TOKEN")
+    if token is not None:
+        env_bearer_token = token
+    try:
+        registry = ModelRegistry()
+        print(f"可用重排模型：{', '.join(registry.entries)}，默认模型：{registry.default_model}")
+        uvicorn.run(app, host='0.0.0.0', port=6006)
+    except Exception as e:
+        print(f"API启动失败！\n报错：\n{e}")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File: benchmark.py
+@Desc: /v1/rerank 吞吐与延迟压测。生成不同文档数、文档长度的合成请求，按给定并发压测，
+       输出 p50/p95/p99 延迟、每秒 pair 数和服务进程峰值 RSS 的 JSON，便于不同版本之间对比。
+
+python benchmark.py --tiny                                     # 进程内压测随机权重的小模型，无需下载模型
+python benchmark.py --model bge-reranker-base --concurrency 1 8 32
+python benchmark.py --url http://127.0.0.1:6006 --token mytoken --model bge-reranker-base --server-pid 12345
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import string
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+ZH_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理府研质"
+EN_WORDS = ["fastgpt", "dataset", "rerank", "model", "query", "document", "vector", "search", "answer",
+            "knowledge", "chunk", "embedding", "token", "latency", "throughput", "cluster", "deploy", "server"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="bge 重排服务压测")
+    parser.add_argument("--url", help="服务地址，如 http://127.0.0.1:6006；不填则在进程内直接压测 app.py")
+    parser.add_argument("--server-pid", type=int,
+                        help="压测远程服务时服务进程的 pid，用于读取其峰值 RSS（仅 Linux）；不填则不输出 RSS")
+    parser.add_argument("--token", default=os.getenv("ACCESS_TOKEN", "ACCESS_TOKEN"), help="Bearer token")
+    parser.add_argument("--model", help="请求中的 model 字段")
+    parser.add_argument("--tiny", action="store_true", help="进程内压测时使用临时生成的随机权重小模型")
+    parser.add_argument("--docs", type=int, nargs="+", default=[10, 50, 200], help="每个请求的文档数")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[64, 256, 1024], help="文档平均字符数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="并发请求数")
+    parser.add_argument("--requests", type=int, default=64, help="每组参数发送的请求数")
+    parser.add_argument("--cache", action="store_true", help="进程内压测时保留分数缓存，默认关闭以测量模型本身")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果 JSON 写入的文件，默认输出到标准输出")
+    return parser.parse_args()
+
+
+def build_tiny_model(path: str):
+    # 随机权重的 BERT 交叉编码器，仅用于测量服务本身的开销
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(string.ascii_lowercase) + list(ZH_CHARS)
+    vocab = list(dict.fromkeys(vocab))
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "vocab.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab))
+    config = BertConfig(vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128, num_labels=1, max_position_embeddings=512)
+    BertForSequenceClassification(config).save_pretrained(path)
+    BertTokenizerFast(os.path.join(path, "vocab.txt")).save_pretrained(path)
+
+
+def make_text(rng: random.Random, length: int) -> str:
+    target = max(1, int(length * rng.uniform(0.8, 1.2)))
+    parts, size = [], 0
+    while size < target:
+        if rng.random() < 0.3:
+            part = rng.choice(EN_WORDS) + " "
+        else:
+            part = "".join(rng.choice(ZH_CHARS) for _ in range(rng.randint(2, 8)))
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)[:target]
+
+
+def make_payloads(rng: random.Random, count: int, docs: int, length: int, model: str) -> List[dict]:
+    payloads = []
+    for _ in range(count):
+        payload = {"query": make_text(rng, 16), "documents": [make_text(rng, length) for _ in range(docs)]}
+        if model:
+            payload["model"] = model
+        payloads.append(payload)
+    return payloads
+
+
+def percentile(values: List[float], q: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    index = (len(values) - 1) * q / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    if pid is None:
+        # 当前进程，Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+    # 其他进程读取 /proc/<pid>/status 中的 VmHWM（峰值 RSS，单位 KB）
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def run_cell(client, headers: dict, payloads: List[dict], concurrency: int) -> dict:
+    queue = list(reversed(payloads))
+    latencies, errors, pairs = [], 0, 0
+
+    async def worker():
+        nonlocal errors, pairs
+        while queue:
+            payload = queue.pop()
+            start = time.perf_counter()
+            try:
+                response = await client.post("/v1/rerank", json=payload, headers=headers)
+                if response.status_code != 200 or "results" not in response.json():
+                    errors += 1
+                    continue
+            except Exception:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            pairs += len(payload["documents"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(payloads),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / max(len(latencies), 1), 2),
+        },
+        # 只统计成功的请求
+        "requests_per_sec": round((len(payloads) - errors) / elapsed, 2),
+        "pairs_per_sec": round(pairs / elapsed, 2),
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=300)
+        mode = "http"
+    else:
+        import app
+
+        app.env_bearer_token = args.token
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://benchmark",
+                                   timeout=300)
+        mode = "in-process"
+    headers = {"Authorization": f"Bearer {args.token}"}
+    rng = random.Random(args.seed)
+    results = []
+    async with client:
+        # 预热：触发模型懒加载，不计入结果
+        await run_cell(client, headers, make_payloads(rng, 2, min(args.docs), min(args.lengths), args.model), 1)
+        for docs in args.docs:
+            for length in args.lengths:
+                for concurrency in args.concurrency:
+                    payloads = make_payloads(rng, args.requests, docs, length, args.model)
+                    result = await run_cell(client, headers, payloads, concurrency)
+                    result.update({"mode": mode, "docs": docs, "doc_length": length, "concurrency": concurrency})
+                    # 进程内压测时服务就在当前进程；压测远程服务时只有给出 --server-pid 才能读取服务的内存
+                    if not args.url:
+                        rss = peak_rss_mb()
+                    else:
+                        rss = peak_rss_mb(args.server_pid) if args.server_pid else None
+                    if rss is not None:
+                        result["peak_rss_mb"] = round(rss, 1)
+                    print(f"docs={docs} length={length} concurrency={concurrency} "
+                          f"p50={result['latency_ms']['p50']}ms p99={result['latency_ms']['p99']}ms "
+                          f"pairs/s={result['pairs_per_sec']}", file=sys.stderr)
+                    results.append(result)
+    config = {key: value for key, value in vars(args).items() if key not in ("token", "output")}
+    return {"config": config, "results": results}
+
+
+def main():
+    args = parse_args()
+    if not args.url:
+        # app.py 在导入时读取环境变量，需要在导入前设置
+        if not args.cache:
+            os.environ["RERANK_CACHE_SIZE"] = "0"
+            os.environ.pop("RERANK_CACHE_DB", None)
+        if args.tiny:
+            model_path = os.path.join(tempfile.mkdtemp(prefix="rerank-bench-"), "tiny-reranker")
+            build_tiny_model(model_path)
+            os.environ["RERANK_MODELS"] = json.dumps({"tiny-reranker": model_path})
+            args.model = args.model or "tiny-reranker"
+    report = json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
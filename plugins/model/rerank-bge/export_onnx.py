@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File: export_onnx.py
+@Desc: 将本地 bge 重排模型导出为 ONNX，并做动态 int8 量化，供 RERANK_BACKEND=onnx 使用。
+
+python export_onnx.py                                   # 导出已注册的全部模型
+python export_onnx.py --models bge-reranker-base --check  # 导出后与 torch 后端对比分数
+"""
+import argparse
+import inspect
+import os
+import sys
+from typing import List
+
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from app import ModelRegistry, OnnxBackend, ReRanker
+
+SAMPLE_PAIRS = [
+    ["什么是 FastGPT", "FastGPT 是一个基于 LLM 大语言模型的知识库问答系统，提供开箱即用的数据处理、模型调用等能力。"],
+    ["什么是 FastGPT", "今天天气很好，适合出去散步。"],
+    ["如何部署重排模型", "将模型放到 models 目录后运行 python app.py，默认监听 6006 端口。"],
+    ["how to deploy the rerank model", "Put the model under the models directory and run python app.py."],
+    ["how to deploy the rerank model", "The quick brown fox jumps over the lazy dog."],
+    ["panda", "The giant panda (Ailuropoda melanoleuca), sometimes called a panda bear or simply panda, "
+              "is a bear species endemic to China. " * 8],
+]
+
+
+def export(model_path: str, opset: int, quantize: bool) -> List[str]:
+    out_dir = os.path.join(model_path, "onnx")
+    os.makedirs(out_dir, exist_ok=True)
+    fp32_path = os.path.join(out_dir, "model.onnx")
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModelForSequenceClassification.from_pretrained(model_path).eval()
+    dummy = tokenizer([["query", "document"]], return_tensors="pt")
+    input_names = [name for name in ["input_ids", "attention_mask", "token_type_ids"] if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    kwargs = {}
+    # 新版本 torch 默认使用 dynamo 导出，这里固定使用 TorchScript 导出以兼容 torch 2.0
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+            **kwargs,
+        )
+    outputs = [fp32_path]
+    print(f"已导出 {fp32_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quant_path = os.path.join(out_dir, "model_quantized.onnx")
+        quantize_dynamic(fp32_path, quant_path, weight_type=QuantType.QInt8)
+        outputs.append(quant_path)
+        print(f"已量化 {quant_path}")
+    return outputs
+
+
+def check(model_path: str, onnx_paths: List[str], tolerance: float) -> bool:
+    reranker = ReRanker(model_path, backend="torch")
+    expected = np.array(reranker.compute_score(SAMPLE_PAIRS))
+    passed = True
+    for onnx_path in onnx_paths:
+        reranker.backend = OnnxBackend(model_path, os.path.basename(onnx_path))
+        actual = np.array(reranker.compute_score(SAMPLE_PAIRS))
+        diff = np.abs(actual - expected)
+        same_order = list(np.argsort(-actual)) == list(np.argsort(-expected))
+        ok = diff.max() <= tolerance
+        passed = passed and ok
+        print(f"{'通过' if ok else '未通过'} {os.path.basename(onnx_path)}: "
+              f"最大误差 {diff.max():.5f}，平均误差 {diff.mean():.5f}，排序一致 {same_order}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 ONNX 重排模型")
+    parser.add_argument("--models", nargs="*", help="模型名，默认导出全部已注册模型")
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--no-quantize", action="store_true", help="只导出 fp32 模型，不做 int8 量化")
+    parser.add_argument("--check", action="store_true", help="导出后与 torch 后端对比样例分数")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="归一化分数允许的最大误差")
+    args = parser.parse_args()
+
+    models = ModelRegistry.discover_models()
+    names = args.models or list(models)
+    passed = True
+    for name in names:
+        if name not in models:
+            print(f"未找到模型 {name}，可选：{', '.join(models)}")
+            sys.exit(1)
+        onnx_paths = export(models[name], args.opset, not args.no_quantize)
+        if args.check:
+            passed = check(models[name], onnx_paths, args.tolerance) and passed
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
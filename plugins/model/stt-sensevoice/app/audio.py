@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+from fastapi import UploadFile
+
+# SenseVoiceSmall 与 fsmn-vad 的输入采样率
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 1 << 20
+# 通过 URL 下载的音频大小上限，单位 MB
+ASR_URL_MAX_MB = float(os.getenv("ASR_URL_MAX_MB", "200"))
+# ISO BMFF（MP4/M4A/MOV）开头的 box 类型
+SEEKABLE_ATOMS = (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip")
+
+
+class AudioDecodeError(ValueError):
+    pass
+
+
+async def decode_upload(file: UploadFile, sample_rate: int = SAMPLE_RATE,
+                        timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    将上传的音频按块送入 ffmpeg 解码为单声道 PCM，直接返回 float32 波形，
+    不落盘，也不需要先把整个压缩文件读入内存。管道解码失败时从头读取上传内容，改用临时文件重试。
+    """
+
+    async def chunks():
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    try:
+        return await decode_stream(chunks(), sample_rate, timings)
+    except AudioDecodeError:
+        await file.seek(0)
+        return await decode_stream(chunks(), sample_rate, timings, seekable=True)
+
+
+async def hash_upload(file: UploadFile):
+    """按块计算上传内容的 blake2b 哈希，之后把读取位置移回开头，不把整个文件读入内存。"""
+    digest = hashlib.blake2b(digest_size=16)
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    await file.seek(0)
+    return digest
+
+
+async def decode_url(client, url: str, sample_rate: int = SAMPLE_RATE,
+                     max_bytes: int = int(ASR_URL_MAX_MB * 1024 * 1024),
+                     timings: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """边下载边解码远程音频，client 为 httpx.AsyncClient，超过 max_bytes 时中止下载。"""
+    async with client.stream("GET", url) as response:
+        if response.status_code != 200:
+            raise AudioDecodeError(f"音频下载失败: HTTP {response.status_code}")
+        length = response.headers.get("content-length")
+        if length is not None and length.isdigit() and int(length) > max_bytes:
+            raise AudioDecodeError(f"音频大小超过限制 {max_bytes} 字节")
+
+        async def chunks():
+            received = 0
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                received += len(chunk)
+                if received > max_bytes:
+                    raise AudioDecodeError(f"音频大小超过限制 {max_bytes} 字节")
+                yield chunk
+
+        return await decode_stream(chunks(), sample_rate, timings)
+
+
+def needs_seek(head: bytes) -> bool:
+    """MP4/M4A/MOV 的 moov 可能位于文件末尾，ffmpeg 无法从管道中解码，需要先写入临时文件。"""
+    return len(head) >= 8 and head[4:8] in SEEKABLE_ATOMS
+
+
+async def decode_stream(chunks: AsyncIterator[bytes], sample_rate: int = SAMPLE_RATE,
+                        timings: Optional[Dict[str, float]] = None, seekable: bool = False) -> np.ndarray:
+    """
+    将任意压缩音频的字节流经 ffmpeg 管道解码为 float32 波形，MP4 类容器或 seekable 为 true 时
+    先写入临时文件再解码。传入 timings 时写入 receive（等待输入数据）与 decode（其余的解码时间）两项耗时（秒）。
+    """
+    start = time.perf_counter()
+    received = 0.0
+
+    async def timed():
+        nonlocal received
+        while True:
+            waiting = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                received += time.perf_counter() - waiting
+            yield chunk
+
+    source = timed()
+    try:
+        head = await source.__anext__()
+    except StopAsyncIteration:
+        head = b""
+    if seekable or needs_seek(head):
+        pcm = await decode_file(head, source, sample_rate)
+    else:
+        pcm = await decode_pipe(head, source, sample_rate)
+
+    audio = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2).astype(np.float32)
+    audio *= 1 / 32768
+    if timings is not None:
+        timings["receive"] = received
+        timings["decode"] = max(0.0, time.perf_counter() - start - received)
+    return audio
+
+
+def ffmpeg_command(source: str, sample_rate: int) -> List[str]:
+    return ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-i", source,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"]
+
+
+async def decode_pipe(head: bytes, chunks: AsyncIterator[bytes], sample_rate: int) -> bytearray:
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command("pipe:0", sample_rate),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            if head:
+                process.stdin.write(head)
+                await process.stdin.drain()
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg 提前退出，错误信息从 stderr 中获取
+            pass
+        finally:
+            process.stdin.close()
+
+    async def collect() -> bytearray:
+        pcm = bytearray()
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            pcm += chunk
+        return pcm
+
+    try:
+        _, pcm, stderr = await asyncio.gather(feed(), collect(), process.stderr.read())
+    except BaseException:
+        # 输入来源出错（如下载超限、连接中断）时结束 ffmpeg，避免残留进程
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        raise
+    await process.wait()
+    if process.returncode != 0 or len(pcm) < 2:
+        raise AudioDecodeError(f"音频解码失败: {stderr.decode(errors='ignore').strip()}")
+    return pcm
+
+
+async def decode_file(head: bytes, chunks: AsyncIterator[bytes], sample_rate: int) -> bytes:
+    """写入临时文件后解码，ffmpeg 可以随机读取，适用于 moov 在末尾的 MP4 等容器。"""
+    loop = asyncio.get_running_loop()
+    fd, path = tempfile.mkstemp(suffix=".audio")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            await loop.run_in_executor(None, f.write, head)
+            async for chunk in chunks:
+                await loop.run_in_executor(None, f.write, chunk)
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_command(path, sample_rate),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            pcm, stderr = await process.communicate()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            raise
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if process.returncode != 0 or len(pcm) < 2:
+        raise AudioDecodeError(f"音频解码失败: {stderr.decode(errors='ignore').strip()}")
+    return pcm
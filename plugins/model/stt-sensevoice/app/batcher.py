@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from funasr.utils.load_utils import extract_fbank
+from funasr.utils.vad_utils import merge_vad
+from torch.nn.utils.rnn import pad_sequence
+
+from audio import SAMPLE_RATE
+from feature_cache import FeatureCache
+
+# 合批窗口：第一个分段到达后最多等待的毫秒数
+ASR_BATCH_MAX_WAIT_MS = float(os.getenv("ASR_BATCH_MAX_WAIT_MS", "10"))
+# 单个批次补齐后的音频总时长上限（批大小 * 批内最长分段），单位秒
+ASR_BATCH_MAX_SECONDS = float(os.getenv("ASR_BATCH_MAX_SECONDS", "60"))
+# VAD 分段合并后的最大时长，单位秒
+ASR_MERGE_LENGTH_S = float(os.getenv("ASR_MERGE_LENGTH_S", "15"))
+
+
+class Segment(object):
+    def __init__(self, audio: np.ndarray, options: tuple, future: asyncio.Future, order: int):
+        self.audio = audio
+        self.options = options
+        self.future = future
+        self.order = order
+
+
+class AsrBatcher(object):
+    """
+    跨请求合批的识别队列：每个请求先做 VAD 切分，分段按 (language, use_itn) 分组、按长度排序，
+    在时长预算内拼成一个补齐的批次做一次编码器前向，再把文本按分段送回各自的请求。
+    """
+
+    def __init__(self, model, max_wait_ms: float = ASR_BATCH_MAX_WAIT_MS,
+                 max_batch_seconds: float = ASR_BATCH_MAX_SECONDS, merge_length_s: float = ASR_MERGE_LENGTH_S,
+                 feature_cache: FeatureCache = None):
+        self.model = model
+        self.feature_cache = feature_cache if feature_cache is not None else FeatureCache()
+        # 影响特征结果的前端配置，写入按原始上传内容缓存的键
+        self.feature_config = model.kwargs.get("frontend_conf")
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_samples = int(max_batch_seconds * SAMPLE_RATE)
+        self.merge_length_ms = int(merge_length_s * 1000)
+        # VAD 与识别分别使用单独的线程，VAD 可以与上一批的 GPU 计算重叠
+        self.vad_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vad")
+        self.asr_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asr")
+        self.pending: List[Segment] = []
+        self.pending_samples = 0
+        self.counter = itertools.count()
+        self.arrival = None
+        self.worker = None
+
+    async def transcribe(self, audio: np.ndarray, language: str = "auto", use_itn: bool = True,
+                         timings: Optional[Dict[str, float]] = None) -> str:
+        """
+        识别一段 16k 波形，返回拼接后的原始文本（含 SenseVoice 的语种、情感等标签）。
+        传入 timings 时写入 vad、batch_wait、fbank、encoder、ctc_decode 各阶段的耗时（秒），
+        分段落在多个批次时累加各批次的耗时，其余时间计入 batch_wait。
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        segments = await loop.run_in_executor(self.vad_executor, self.vad, audio)
+        if timings is not None:
+            timings["vad"] = time.perf_counter() - start
+        if len(segments) == 0:
+            return ""
+        self._ensure_worker()
+        options = (language, use_itn)
+        enqueued = time.perf_counter()
+        futures = []
+        for begin_ms, end_ms in segments:
+            chunk = audio[int(begin_ms * SAMPLE_RATE / 1000):int(end_ms * SAMPLE_RATE / 1000)]
+            if len(chunk) == 0:
+                continue
+            future = loop.create_future()
+            self.pending.append(Segment(chunk, options, future, next(self.counter)))
+            self.pending_samples += len(chunk)
+            futures.append(future)
+        self.arrival.set()
+        results = await asyncio.gather(*futures)
+        if timings is not None:
+            batches = {id(stats): stats for _, stats in results}
+            for stage in ("fbank", "encoder", "ctc_decode"):
+                timings[stage] = sum(stats[stage] for stats in batches.values())
+            # 其余时间都花在排队等待合批和其他请求的计算上
+            timings["batch_wait"] = max(0.0, time.perf_counter() - enqueued - sum(
+                timings[stage] for stage in ("fbank", "encoder", "ctc_decode")))
+        return " ".join(text for text, _ in results if text)
+
+    def vad(self, audio: np.ndarray) -> List[List[int]]:
+        key = None
+        if self.feature_cache.enabled:
+            key = FeatureCache.key(audio, "vad")
+            cached = self.feature_cache.get(key)
+            if cached is not None:
+                return cached.tolist()
+        res = self.model.inference(audio, model=self.model.vad_model, kwargs=self.model.vad_kwargs)
+        segments = res[0]["value"] if len(res) > 0 else []
+        segments = merge_vad(segments, self.merge_length_ms)
+        if key is not None:
+            self.feature_cache.put(key, np.array(segments, dtype=np.int64).reshape(-1, 2))
+        return segments
+
+    def features(self, audios: List[np.ndarray]) -> List[torch.Tensor]:
+        """提取每个分段的 LFR 特征，命中缓存的分段跳过计算。"""
+        keys = [FeatureCache.key(audio) for audio in audios]
+        feats = [self.feature_cache.get(key) for key in keys]
+        misses = [index for index, feat in enumerate(feats) if feat is None]
+        if len(misses) > 0:
+            speech, speech_lengths = extract_fbank(
+                [audios[index] for index in misses], data_type="sound", frontend=self.model.kwargs["frontend"])
+            for row, index in enumerate(misses):
+                feats[index] = speech[row, :int(speech_lengths[row])].numpy().copy()
+                self.feature_cache.put(keys[index], feats[index])
+        return [torch.from_numpy(feat) for feat in feats]
+
+    def _ensure_worker(self):
+        if self.worker is None or self.worker.done():
+            self.arrival = asyncio.Event()
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _wait_for_batch(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while self.pending_samples < self.max_batch_samples:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self.arrival.clear()
+            try:
+                await asyncio.wait_for(self.arrival.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _take_batch(self) -> List[Segment]:
+        self.pending = [segment for segment in self.pending if not segment.future.done()]
+        self.pending_samples = sum(len(segment.audio) for segment in self.pending)
+        if len(self.pending) == 0:
+            return []
+        # 以最早到达的分段为中心，在同一组参数里向长度相近的分段扩展，既减少补齐浪费也不会饿死
+        oldest = min(self.pending, key=lambda segment: segment.order)
+        group = sorted([segment for segment in self.pending if segment.options == oldest.options],
+                       key=lambda segment: len(segment.audio))
+        center = group.index(oldest)
+        lo = hi = center
+        while True:
+            size = hi - lo + 2
+            can_lo = lo > 0 and size * len(group[hi].audio) <= self.max_batch_samples
+            can_hi = hi < len(group) - 1 and size * len(group[hi + 1].audio) <= self.max_batch_samples
+            if can_lo and (not can_hi or len(oldest.audio) - len(group[lo - 1].audio)
+                           <= len(group[hi + 1].audio) - len(oldest.audio)):
+                lo -= 1
+            elif can_hi:
+                hi += 1
+            else:
+                break
+        batch = group[lo:hi + 1]
+        taken = set(id(segment) for segment in batch)
+        self.pending = [segment for segment in self.pending if id(segment) not in taken]
+        self.pending_samples -= sum(len(segment.audio) for segment in batch)
+        return batch
+
+    def recognize(self, audios: List[np.ndarray], language: str, use_itn: bool) -> Tuple[List[str], dict]:
+        kwargs = dict(self.model.kwargs)
+        kwargs.pop("cache", None)
+        kwargs.update({"language": language, "use_itn": use_itn})
+        data_in, data_lengths, fbank = audios, None, 0.0
+        if self.feature_cache.enabled:
+            start = time.perf_counter()
+            feats = self.features(audios)
+            data_in = pad_sequence(feats, batch_first=True)
+            data_lengths = torch.tensor([len(feat) for feat in feats], dtype=torch.int32)
+            kwargs["data_type"] = "fbank"
+            fbank = time.perf_counter() - start
+        with torch.no_grad():
+            results, meta_data = self.model.model.inference(
+                data_in=data_in, data_lengths=data_lengths, key=[str(index) for index in range(len(audios))],
+                **kwargs)
+        stats = {
+            "fbank": fbank + float(meta_data.get("load_data", 0)) + float(meta_data.get("extract_feat", 0)),
+            "encoder": float(meta_data.get("encoder", 0)),
+            "ctc_decode": float(meta_data.get("decode", 0)),
+        }
+        return [result["text"] for result in results], stats
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self.pending) == 0:
+                self.arrival.clear()
+                await self.arrival.wait()
+                continue
+            await self._wait_for_batch()
+            batch = self._take_batch()
+            if len(batch) == 0:
+                continue
+            language, use_itn = batch[0].options
+            try:
+                texts, stats = await loop.run_in_executor(
+                    self.asr_executor, self.recognize, [segment.audio for segment in batch], language, use_itn)
+            except Exception as e:
+                for segment in batch:
+                    if not segment.future.done():
+                        segment.future.set_exception(e)
+                continue
+            for segment, text in zip(batch, texts):
+                if not segment.future.done():
+                    segment.future.set_result((text, stats))
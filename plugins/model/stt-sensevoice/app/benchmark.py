@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@File: benchmark.py
+@Desc: SenseVoice 编码器位置编码表与 query embedding 缓存的微基准。用随机权重构建模型，对不同长度的
+       短音频特征分别计时位置编码、query embedding 以及首个分块的 encoder.forward_chunk，
+       对比缓存前后每次调用的耗时（微秒），并校验两种实现的输出一致，结果以 JSON 输出。
+
+python benchmark.py                                   # CPU，6 层小编码器
+python benchmark.py --device cuda:0 --blocks 50 --tp-blocks 20   # 与 SenseVoiceSmall 相同的层数
+"""
+import argparse
+import contextlib
+import json
+import time
+
+import torch
+
+from model import SenseVoiceSmall, SinusoidalPositionEncoder
+
+# LFR 后的特征维度（80 维 fbank * 7 帧）
+INPUT_SIZE = 560
+# 每个阶段交替计时的轮数
+ROUNDS = 5
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SenseVoice 编码器缓存微基准")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--frames", type=int, nargs="+", default=[10, 30, 100, 500],
+                        help="LFR 特征帧数，每帧 60ms")
+    parser.add_argument("--blocks", type=int, default=6, help="编码器层数，SenseVoiceSmall 为 50")
+    parser.add_argument("--tp-blocks", type=int, default=0, help="tp 编码器层数，SenseVoiceSmall 为 20")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果 JSON 写入的文件，默认输出到标准输出")
+    return parser.parse_args()
+
+
+def baseline_position_forward(self, x, start_idx: int = 0):
+    # 缓存之前的实现：每次调用重新生成位置与 sin/cos 表
+    batch_size, timesteps, input_dim = x.size()
+    positions = torch.arange(start_idx + 1, start_idx + timesteps + 1, device=x.device)[None, :]
+    position_encoding = self.encode(positions, input_dim, x.dtype).to(x.device)
+    return x + position_encoding
+
+
+def baseline_query_embedding(self, language: str, textnorm: str, device: torch.device):
+    # 缓存之前的实现：每次调用分别查三次 embedding 再拼接
+    language_query = self.embed(
+        torch.LongTensor([[self.lid_dict[language] if language in self.lid_dict else 0]]).to(device))
+    textnorm_query = self.embed(torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(device))
+    event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(device))
+    return torch.cat((language_query, event_emo_query, textnorm_query), dim=1)
+
+
+def mode_context(mode: str):
+    return uncached() if mode == "uncached" else contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def uncached():
+    position_forward = SinusoidalPositionEncoder.forward
+    query_embedding = SenseVoiceSmall.query_embedding
+    SinusoidalPositionEncoder.forward = baseline_position_forward
+    SenseVoiceSmall.query_embedding = baseline_query_embedding
+    try:
+        yield
+    finally:
+        SinusoidalPositionEncoder.forward = position_forward
+        SenseVoiceSmall.query_embedding = query_embedding
+
+
+def build_model(args) -> SenseVoiceSmall:
+    encoder_conf = {"output_size": 512, "attention_heads": 4, "linear_units": 2048, "num_blocks": args.blocks,
+                    "tp_blocks": args.tp_blocks, "kernel_size": 11, "sanm_shfit": 0}
+    model = SenseVoiceSmall(encoder="SenseVoiceEncoderSmall", encoder_conf=encoder_conf,
+                            input_size=INPUT_SIZE, vocab_size=25055)
+    return model.to(args.device).eval()
+
+
+def timeit(fn, iterations: int, device: torch.device) -> float:
+    """返回每次调用的平均耗时，单位微秒。"""
+    for _ in range(min(10, iterations)):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def run_case(model: SenseVoiceSmall, frames: int, args) -> dict:
+    device = torch.device(args.device)
+    speech = torch.randn(1, frames, INPUT_SIZE, device=device)
+    encoder = model.encoder
+
+    def position():
+        return encoder.embed(speech)
+
+    def query():
+        return model.query_embedding("auto", "withitn", device)
+
+    def first_chunk():
+        xs = torch.cat((model.query_embedding("auto", "withitn", device), speech), dim=1)
+        return encoder.forward_chunk(xs, {}, (0, xs.size(1), 0))
+
+    result = {"frames": frames}
+    outputs = {}
+    for mode in ("uncached", "cached"):
+        with mode_context(mode):
+            outputs[mode] = first_chunk()
+    for name, fn in (("position_encoding", position), ("query_embedding", query), ("forward_chunk", first_chunk)):
+        # 两种实现交替计时，各取最快的一轮，减少机器负载波动的影响
+        best = {}
+        for _ in range(ROUNDS):
+            for mode in ("uncached", "cached"):
+                with mode_context(mode):
+                    elapsed = timeit(fn, max(1, args.iterations // ROUNDS), device)
+                best[mode] = min(best.get(mode, elapsed), elapsed)
+        result[name] = {f"{mode}_us": round(best[mode], 1) for mode in ("uncached", "cached")}
+    for name in ("position_encoding", "query_embedding", "forward_chunk"):
+        stage = result[name]
+        stage["saved_us"] = round(stage["uncached_us"] - stage["cached_us"], 1)
+        stage["speedup"] = round(stage["uncached_us"] / max(stage["cached_us"], 1e-9), 2)
+    result["max_abs_diff"] = float((outputs["cached"] - outputs["uncached"]).abs().max())
+    return result
+
+
+def main():
+    args = parse_args()
+    torch.manual_seed(args.seed)
+    model = build_model(args)
+    with torch.no_grad():
+        results = [run_case(model, frames, args) for frames in args.frames]
+    report = {"device": args.device, "blocks": args.blocks, "tp_blocks": args.tp_blocks,
+              "iterations": args.iterations, "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
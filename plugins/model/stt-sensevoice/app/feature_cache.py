@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+import metrics
+
+# 内存中特征缓存的大小上限，单位 MB，0 表示关闭缓存
+ASR_FEATURE_CACHE_MB = float(os.getenv("ASR_FEATURE_CACHE_MB", "0"))
+# 从内存淘汰的特征写入的目录，不配置则直接丢弃
+ASR_FEATURE_CACHE_DIR = os.getenv("ASR_FEATURE_CACHE_DIR", "")
+# 磁盘缓存的大小上限，单位 MB
+ASR_FEATURE_CACHE_DISK_MB = float(os.getenv("ASR_FEATURE_CACHE_DISK_MB", "2048"))
+
+
+class FeatureCache(object):
+    """
+    以音频内容哈希为键的特征缓存：内存中按字节数做 LRU 淘汰，淘汰的条目落盘为 .npy，
+    磁盘同样按大小上限淘汰最久未用的文件。同一段音频重复识别（重试、换 language/use_itn）时
+    可以跳过 ffmpeg 解码（按原始上传内容缓存解码后的 PCM）、VAD 与 fbank/LFR 特征提取。
+    """
+
+    def __init__(self, max_mb: float = ASR_FEATURE_CACHE_MB, spill_dir: str = ASR_FEATURE_CACHE_DIR,
+                 max_disk_mb: float = ASR_FEATURE_CACHE_DISK_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self.spill_dir = spill_dir if self.enabled else ""
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            # 重启后沿用已有的文件，按修改时间恢复 LRU 顺序
+            entries = []
+            for name in os.listdir(self.spill_dir):
+                if name.endswith(".npy"):
+                    stat = os.stat(os.path.join(self.spill_dir, name))
+                    entries.append((stat.st_mtime, name[:-4], stat.st_size))
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_bytes += size
+
+    @staticmethod
+    def key(audio: np.ndarray, namespace: str = "fbank") -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(audio).view(np.uint8), digest_size=16)
+        return f"{namespace}-{digest.hexdigest()}"
+
+    @staticmethod
+    def source_key(digest, *config) -> str:
+        """原始上传内容的键：内容哈希加上采样率、特征配置等影响解码与特征结果的参数。"""
+        digest = digest.copy()
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode("utf-8"))
+        return f"upload-{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                metrics.feature_cache_hits.inc()
+                return value
+            if key not in self.disk:
+                metrics.feature_cache_misses.inc()
+                return None
+            self.disk_bytes -= self.disk.pop(key)
+        path = os.path.join(self.spill_dir, key + ".npy")
+        try:
+            value = np.load(path)
+            os.remove(path)
+        except (OSError, ValueError):
+            metrics.feature_cache_misses.inc()
+            return None
+        metrics.feature_cache_hits.inc()
+        # 命中的磁盘条目重新放回内存
+        self.put(key, value)
+        return value
+
+    def put(self, key: str, value: np.ndarray):
+        if not self.enabled or value.nbytes > self.max_bytes:
+            return
+        spilled = []
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key).nbytes
+            self.memory[key] = value
+            self.memory_bytes += value.nbytes
+            while self.memory_bytes > self.max_bytes:
+                old_key, old_value = self.memory.popitem(last=False)
+                self.memory_bytes -= old_value.nbytes
+                spilled.append((old_key, old_value))
+        for old_key, old_value in spilled:
+            self._spill(old_key, old_value)
+
+    def _spill(self, key: str, value: np.ndarray):
+        if not self.spill_dir or value.nbytes > self.max_disk_bytes:
+            return
+        path = os.path.join(self.spill_dir, key + ".npy")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, value)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        size = os.path.getsize(path)
+        removed = []
+        with self.lock:
+            self.disk_bytes -= self.disk.pop(key, 0)
+            self.disk[key] = size
+            self.disk_bytes += size
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, old_size = self.disk.popitem(last=False)
+                self.disk_bytes -= old_size
+                removed.append(old_key)
+        for old_key in removed:
+            try:
+                os.remove(os.path.join(self.spill_dir, old_key + ".npy"))
+            except OSError:
+                pass
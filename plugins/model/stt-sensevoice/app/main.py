@@ -1,19 +1,54 @@
 # -*- coding: utf-8 -*-
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from pydantic import BaseModel, HttpUrl, ValidationError
+import asyncio
+import json
+import os
+import time
+
+import httpx
+import numpy as np
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, HttpUrl
 from typing import List
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
-import uuid
-import os
+import metrics
+from audio import SAMPLE_RATE, AudioDecodeError, decode_upload, decode_url, hash_upload
+from batcher import AsrBatcher
+from feature_cache import FeatureCache
+from streaming import ASR_STREAM_RESCORE, StreamLimitExceeded, StreamSession
+
+# 识别语种，auto 为自动检测
+language = os.getenv("ASR_LANGUAGE", "auto")
+# /upload-url/ 同时下载、解码的 URL 数
+ASR_URL_CONCURRENCY = int(os.getenv("ASR_URL_CONCURRENCY", "8"))
+# 下载超时，单位秒
+ASR_URL_TIMEOUT = float(os.getenv("ASR_URL_TIMEOUT", "60"))
+
+class RequestTimer(object):
+    """记录请求到达的时间，上传文件在进入接口前就已接收完毕，接收耗时需要从这里算起。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["received_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
+
 
 app = FastAPI()
+app.add_middleware(RequestTimer)
+http_client = None
+url_semaphore = None
 
 
 # 数据验证模型
 class UrlInput(BaseModel):
     audio_urls: List[HttpUrl]
+    # 为 true 时按完成顺序逐行返回每个 URL 的结果（NDJSON）
+    stream: bool = False
 
 
 # 模型加载
@@ -28,68 +63,183 @@ model = AutoModel(
     vad_model="fsmn-vad",
     vad_kwargs={"max_single_segment_time": 30000},
     trust_remote_code=True,
+    remote_code="./model.py",
     device="cuda:0",
 )
 
+# 并发请求的 VAD 分段在这里合批识别
+batcher = AsrBatcher(model)
+
+
+@app.on_event("startup")
+async def startup():
+    global http_client, url_semaphore
+    http_client = httpx.AsyncClient(
+        timeout=ASR_URL_TIMEOUT,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=ASR_URL_CONCURRENCY, max_keepalive_connections=ASR_URL_CONCURRENCY),
+    )
+    url_semaphore = asyncio.Semaphore(ASR_URL_CONCURRENCY)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
+
+def finish_timings(endpoint: str, timings: dict, audio: np.ndarray, start: float) -> dict:
+    """上报各阶段耗时并转换为响应中的毫秒数。"""
+    metrics.record(endpoint, timings, len(audio) / SAMPLE_RATE, time.perf_counter() - start)
+    return {stage: round(timings[stage] * 1000, 1) for stage in metrics.STAGES if stage in timings}
+
+
+async def load_upload(file: UploadFile, timings: dict) -> np.ndarray:
+    """启用特征缓存时先按原始上传内容查缓存，命中则跳过 ffmpeg 解码。"""
+    cache = batcher.feature_cache
+    if not cache.enabled:
+        return await decode_upload(file, timings=timings)
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    key = FeatureCache.source_key(await hash_upload(file), SAMPLE_RATE, batcher.feature_config)
+    pcm = await loop.run_in_executor(None, cache.get, key)
+    lookup = time.perf_counter() - start
+    if pcm is not None:
+        timings["receive"] = 0.0
+        timings["decode"] = lookup
+        return pcm.astype(np.float32) * (1 / 32768)
+    audio = await decode_upload(file, timings=timings)
+    timings["decode"] += lookup
+    # 解码结果原本就是 16bit PCM，按 int16 缓存节省一半空间
+    await loop.run_in_executor(None, cache.put, key, np.round(audio * 32768).astype(np.int16))
+    return audio
+
+
+async def transcribe_url(index: int, url: str) -> dict:
+    try:
+        start = time.perf_counter()
+        timings = {}
+        # 下载与 ffmpeg 解码并发进行，信号量限制同时进行中的 URL 数
+        async with url_semaphore:
+            audio = await decode_url(http_client, url, timings=timings)
+        text = await batcher.transcribe(audio, language=language, use_itn=False, timings=timings)
+        postprocess = time.perf_counter()
+        text = rich_transcription_postprocess(text)
+        timings["postprocess"] = time.perf_counter() - postprocess
+        return {"index": index, "url": url, "text": text,
+                "timings": finish_timings("upload-url", timings, audio, start)}
+    except AudioDecodeError as e:
+        return {"index": index, "url": url, "error": str(e)}
+    except httpx.HTTPError as e:
+        return {"index": index, "url": url, "error": f"音频下载失败: {e!r}"}
+    except Exception as e:
+        return {"index": index, "url": url, "error": str(e)}
+
 
 @app.post("/upload-url/")
 async def upload_url(data: UrlInput):
-    try:
-        results = []
-        for url in data.audio_urls:
-            res = model.generate(
-                input=str(url),  # 将 URL 转换为字符串
-                cache={},
-                language=language,
-                use_itn=False,
-                batch_size=batch_size,
-            )
-            data = rich_transcription_postprocess(res[0]["text"])
-            results.append(data)
-        return {"message": "URL input processed successfully", "results": results}
-    except ValidationError as e:
-        raise HTTPException(status_code=400, detail=e.errors())
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    urls = [str(url) for url in data.audio_urls]
+    tasks = [asyncio.ensure_future(transcribe_url(index, url)) for index, url in enumerate(urls)]
+
+    if data.stream:
+        async def results():
+            try:
+                for task in asyncio.as_completed(tasks):
+                    yield json.dumps(await task, ensure_ascii=False) + "\n"
+            finally:
+                # 客户端断开时取消尚未完成的 URL
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(results(), media_type="application/x-ndjson")
+
+    items = await asyncio.gather(*tasks)
+    errors = [item for item in items if "error" in item]
+    if len(errors) == len(items) and len(items) > 0:
+        raise HTTPException(status_code=400, detail=errors)
+    return {
+        "message": "URL input processed successfully",
+        "results": [item.get("text") for item in items],
+        "errors": errors,
+    }
 
 
 @app.post("/v1/audio/transcriptions")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(request: Request, file: UploadFile = File(...)):
     try:
         #for file in files:
             if not file.content_type.startswith("audio/"):
                 raise HTTPException(status_code=400, detail="Invalid file type")
 
-            # 读取文件为 bytes
-            #audio_bytes = await file.read()
-
-            unique_filename = str(uuid.uuid4()) + ".mp3"
-
-            # 保存上传的音频文件
-            audio_file_path = os.path.join("/tmp", unique_filename)
-            with open(audio_file_path, "wb") as audio_file:
-                audio_file.write(await file.read())
-
-            # 直接将文件对象传递给模型
-            res = model.generate(
-                input=audio_file_path,
-                cache={},
-                language=language,
-                use_itn=True,
-                batch_size=batch_size,
-                merge_vad=True,  #
-                merge_length_s=15,
-            )
-            data = rich_transcription_postprocess(res[0]["text"])
-            return {"message": "File inputs processed successfully", "text": data}
+            start = getattr(request.state, "received_at", time.perf_counter())
+            timings = {}
+            # 边接收边解码为 16k 单声道波形，不写临时文件；相同的上传内容命中缓存时不再解码
+            try:
+                uploaded = time.perf_counter() - start
+                audio = await load_upload(file, timings)
+                timings["receive"] += uploaded
+            except AudioDecodeError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+            # VAD 切分后与其他请求的分段一起合批识别
+            text = await batcher.transcribe(audio, language=language, use_itn=True, timings=timings)
+            postprocess = time.perf_counter()
+            data = rich_transcription_postprocess(text)
+            timings["postprocess"] = time.perf_counter() - postprocess
+            return {"message": "File inputs processed successfully", "text": data,
+                    "timings": finish_timings("transcriptions", timings, audio, start)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-if __name__ == "__main__":
-    batch_size = 60
-    language = "auto"
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
+@app.websocket("/v1/audio/transcriptions/stream")
+async def transcribe_stream(websocket: WebSocket, language: str = "auto", use_itn: bool = True):
+    """
+    流式识别：客户端持续发送 16k 单声道 s16le PCM 二进制帧，服务端每凑齐一个块返回一次
+    {"type": "partial", "text": ...}；客户端发送任意文本帧表示音频结束，服务端返回
+    {"type": "final", "text": ...} 后关闭连接。音频时长超过 ASR_STREAM_MAX_SECONDS 时返回
+    {"type": "error", ...} 并以 1008 关闭连接。
+    """
+    await websocket.accept()
+    session = StreamSession(model, language=language, use_itn=use_itn)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                # 与离线批次共用识别线程，避免同时占用 GPU
+                text = await loop.run_in_executor(batcher.asr_executor, session.feed, message["bytes"])
+                if text is not None:
+                    await websocket.send_json({"type": "partial", "text": rich_transcription_postprocess(text)})
+            elif message.get("text") is not None:
+                break
+
+        if ASR_STREAM_RESCORE:
+            audio = session.audio()
+            text = await batcher.transcribe(audio, language=language, use_itn=use_itn) if len(audio) > 0 else ""
+        else:
+            text = await loop.run_in_executor(batcher.asr_executor, session.finish)
+        await websocket.send_json({"type": "final", "text": rich_transcription_postprocess(text)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except StreamLimitExceeded as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=1008)
+    except Exception as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=1011)
+
+
+if __name__ == "__main__":
     import uvicorn
 
     uvicorn.run(app, host="0.0.0.0", port=8000)
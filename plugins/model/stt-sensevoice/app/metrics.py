@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from typing import Dict, Iterable, List
+
+# 各阶段耗时直方图的桶边界，单位秒
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 识别流程的阶段：接收上传、ffmpeg 解码、VAD、等待合批、fbank、编码器、CTC 解码、后处理
+STAGES = ("receive", "decode", "vad", "batch_wait", "fbank", "encoder", "ctc_decode", "postprocess")
+
+
+class Histogram(object):
+    """按一个标签区分的直方图，输出 Prometheus 文本格式。"""
+
+    def __init__(self, name: str, doc: str, label: str, buckets: Iterable[float] = STAGE_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series: Dict[str, List] = {}
+
+    def observe(self, label_value: str, value: float):
+        with self.lock:
+            series = self.series.setdefault(label_value, [[0] * len(self.buckets), 0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, (counts, count, total) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class Gauge(object):
+    def __init__(self, name: str, doc: str, kind: str = "gauge"):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, value: float = 1):
+        self.value += value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}", f"{self.name} {self.value}"]
+
+
+stage_seconds = Histogram("stt_stage_seconds", "Time spent in each stage of a transcription request.", "stage")
+request_seconds = Histogram("stt_request_seconds", "End-to-end latency of transcription requests.", "endpoint")
+real_time_factor = Gauge("stt_real_time_factor", "Processing time divided by audio duration of the last request.")
+audio_seconds = Gauge("stt_audio_seconds_total", "Total seconds of audio transcribed.", kind="counter")
+feature_cache_hits = Gauge("stt_feature_cache_hits_total", "Feature cache hits.", kind="counter")
+feature_cache_misses = Gauge("stt_feature_cache_misses_total", "Feature cache misses.", kind="counter")
+
+
+def record(endpoint: str, timings: Dict[str, float], audio_duration: float, elapsed: float):
+    """记录一次请求的各阶段耗时（秒）、音频时长与总耗时。"""
+    for stage, seconds in timings.items():
+        stage_seconds.observe(stage, seconds)
+    request_seconds.observe(endpoint, elapsed)
+    audio_seconds.inc(audio_duration)
+    if audio_duration > 0:
+        real_time_factor.set(elapsed / audio_duration)
+
+
+def render() -> str:
+    lines = []
+    for metric in (stage_seconds, request_seconds, real_time_factor, audio_seconds,
+                   feature_cache_hits, feature_cache_misses):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
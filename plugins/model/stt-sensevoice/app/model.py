@@ -18,8 +18,10 @@ from funasr.utils.load_utils import load_audio_text_image_video, extract_fbank
 class SinusoidalPositionEncoder(torch.nn.Module):
     """ """
 
-    def __int__(self, d_model=80, dropout_rate=0.1):
-        pass
+    def __init__(self, d_model=80, dropout_rate=0.1):
+        super().__init__()
+        # sin/cos tables keyed by (depth, dtype, device), grown on demand and sliced per call
+        self._tables = {}
 
     def encode(
         self, positions: torch.Tensor = None, depth: int = None, dtype: torch.dtype = torch.float32
@@ -40,10 +42,22 @@ class SinusoidalPositionEncoder(torch.nn.Module):
         encoding = torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=2)
         return encoding.type(dtype)
 
-    def forward(self, x):
+    def encoding(self, length: int, depth: int, dtype: torch.dtype, device: torch.device):
+        key = (depth, dtype, device)
+        table = self._tables.get(key)
+        if table is None or table.size(1) < length:
+            size = 512
+            while size < length:
+                size *= 2
+            positions = torch.arange(1, size + 1, device=device)[None, :]
+            table = self.encode(positions, depth, dtype)
+            self._tables[key] = table
+        return table
+
+    def forward(self, x, start_idx: int = 0):
         batch_size, timesteps, input_dim = x.size()
-        positions = torch.arange(1, timesteps + 1, device=x.device)[None, :]
-        position_encoding = self.encode(positions, input_dim, x.dtype).to(x.device)
+        table = self.encoding(start_idx + timesteps, input_dim, x.dtype, x.device)
+        position_encoding = table[:, start_idx : start_idx + timesteps]
 
         return x + position_encoding
 
@@ -576,6 +590,44 @@ class SenseVoiceEncoderSmall(nn.Module):
         xs_pad = self.tp_norm(xs_pad)
         return xs_pad, olens
 
+    def forward_chunk(
+        self,
+        xs_pad: torch.Tensor,
+        cache: dict,
+        chunk_size: tuple,
+        look_back: int = -1,
+    ):
+        """Encode one streaming chunk.
+
+        Args:
+            xs_pad: (1, chunk_size[1] + chunk_size[2], D) features of the chunk with its lookahead frames.
+            cache: per-session state, updated in place. "offset" is the number of frames already encoded,
+                "layers" the key/value caches of every attention layer.
+            chunk_size: (0, chunk, lookahead). The last chunk_size[2] frames are only used as right
+                context and will be encoded again with the next chunk.
+            look_back: number of previous chunks to attend to, -1 for all of them.
+        """
+        xs_pad = xs_pad * self.output_size() ** 0.5
+        xs_pad = self.embed(xs_pad, cache.get("offset", 0))
+
+        layers = list(self.encoders0) + list(self.encoders)
+        layer_caches = cache.get("layers") or [None] * (len(layers) + len(self.tp_encoders))
+        for layer_idx, encoder_layer in enumerate(layers):
+            xs_pad, layer_caches[layer_idx] = encoder_layer.forward_chunk(
+                xs_pad, layer_caches[layer_idx], chunk_size, look_back
+            )
+        xs_pad = self.after_norm(xs_pad)
+
+        for layer_idx, encoder_layer in enumerate(self.tp_encoders, start=len(layers)):
+            xs_pad, layer_caches[layer_idx] = encoder_layer.forward_chunk(
+                xs_pad, layer_caches[layer_idx], chunk_size, look_back
+            )
+        xs_pad = self.tp_norm(xs_pad)
+
+        cache["layers"] = layer_caches
+        cache["offset"] = cache.get("offset", 0) + xs_pad.size(1) - chunk_size[2]
+        return xs_pad
+
 
 @tables.register("model_classes", "SenseVoiceSmall")
 class SenseVoiceSmall(nn.Module):
@@ -637,6 +689,7 @@ class SenseVoiceSmall(nn.Module):
         self.textnorm_int_dict = {25016: 14, 25017: 15}
         self.embed = torch.nn.Embedding(7 + len(self.lid_dict) + len(self.textnorm_dict), input_size)
         self.emo_dict = {"unk": 25009, "happy": 25001, "sad": 25002, "angry": 25003, "neutral": 25004}
+        self._query_cache = {}
         
         self.criterion_att = LabelSmoothingLoss(
             size=self.vocab_size,
@@ -777,6 +830,24 @@ class SenseVoiceSmall(nn.Module):
         return loss_rich, acc_rich
 
 
+    def query_embedding(self, language: str, textnorm: str, device: torch.device):
+        """Embeddings of the [language, event, emotion, textnorm] query frames, (1, 4, D).
+
+        Cached per device at inference time; the cache follows in-place updates of the embedding weights.
+        """
+        lid = self.lid_dict[language] if language in self.lid_dict else 0
+        query = torch.LongTensor([[lid, 1, 2, self.textnorm_dict[textnorm]]])
+        if torch.is_grad_enabled():
+            return self.embed(query.to(device))
+
+        key = (lid, textnorm, device)
+        version = self.embed.weight._version
+        cached = self._query_cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, self.embed(query.to(device)))
+            self._query_cache[key] = cached
+        return cached[1]
+
     def inference(
         self,
         data_in,
@@ -822,33 +893,23 @@ class SenseVoiceSmall(nn.Module):
         speech_lengths = speech_lengths.to(device=kwargs["device"])
 
         language = kwargs.get("language", "auto")
-        language_query = self.embed(
-            torch.LongTensor(
-                [[self.lid_dict[language] if language in self.lid_dict else 0]]
-            ).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        
         use_itn = kwargs.get("use_itn", False)
         textnorm = kwargs.get("text_norm", None)
         if textnorm is None:
             textnorm = "withitn" if use_itn else "woitn"
-        textnorm_query = self.embed(
-            torch.LongTensor([[self.textnorm_dict[textnorm]]]).to(speech.device)
-        ).repeat(speech.size(0), 1, 1)
-        speech = torch.cat((textnorm_query, speech), dim=1)
-        speech_lengths += 1
-
-        event_emo_query = self.embed(torch.LongTensor([[1, 2]]).to(speech.device)).repeat(
-            speech.size(0), 1, 1
-        )
-        input_query = torch.cat((language_query, event_emo_query), dim=1)
-        speech = torch.cat((input_query, speech), dim=1)
-        speech_lengths += 3
+        input_query = self.query_embedding(language, textnorm, speech.device)
+        speech = torch.cat((input_query.expand(speech.size(0), -1, -1), speech), dim=1)
+        speech_lengths += 4
 
         # Encoder
+        time4 = time.perf_counter()
         encoder_out, encoder_out_lens = self.encoder(speech, speech_lengths)
         if isinstance(encoder_out, tuple):
             encoder_out = encoder_out[0]
+        if encoder_out.is_cuda:
+            torch.cuda.synchronize(encoder_out.device)
+        time5 = time.perf_counter()
+        meta_data["encoder"] = f"{time5 - time4:0.3f}"
 
         # c. Passed the encoder result and the beam search
         ctc_logits = self.ctc.log_softmax(encoder_out)
@@ -861,31 +922,106 @@ class SenseVoiceSmall(nn.Module):
             key = key[0]
         if len(key) < b:
             key = key * b
-        for i in range(b):
-            x = ctc_logits[i, : encoder_out_lens[i].item(), :]
-            yseq = x.argmax(dim=-1)
-            yseq = torch.unique_consecutive(yseq, dim=-1)
 
-            ibest_writer = None
-            if kwargs.get("output_dir") is not None:
-                if not hasattr(self, "writer"):
-                    self.writer = DatadirWriter(kwargs.get("output_dir"))
-                ibest_writer = self.writer[f"1best_recog"]
+        ibest_writer = None
+        if kwargs.get("output_dir") is not None:
+            if not hasattr(self, "writer"):
+                self.writer = DatadirWriter(kwargs.get("output_dir"))
+            ibest_writer = self.writer[f"1best_recog"]
 
-            mask = yseq != self.blank_id
-            token_int = yseq[mask].tolist()
-
-            # Change integer-ids to tokens
-            text = tokenizer.decode(token_int)
-
-            result_i = {"key": key[i], "text": text}
+        token_lists = self.ctc_greedy_search(ctc_logits, encoder_out_lens)
+        texts = self.decode_tokens(token_lists, tokenizer)
+        meta_data["decode"] = f"{time.perf_counter() - time5:0.3f}"
+        for i in range(b):
+            result_i = {"key": key[i], "text": texts[i]}
             results.append(result_i)
 
             if ibest_writer is not None:
-                ibest_writer["text"][key[i]] = text
+                ibest_writer["text"][key[i]] = texts[i]
 
         return results, meta_data
 
+    def ctc_greedy_search(self, ctc_logits: torch.Tensor, ctc_lens: torch.Tensor):
+        """Batched greedy CTC search over a padded batch.
+
+        Collapses repeats and drops blanks on device, then moves all tokens to the host in one transfer.
+
+        Args:
+            ctc_logits: (B, T, V) log-probabilities.
+            ctc_lens: (B,) valid frames of every item.
+
+        Returns:
+            A list of token id lists, one per item.
+        """
+        b, n, _ = ctc_logits.size()
+        yseq = ctc_logits.argmax(dim=-1)
+        keep = torch.arange(n, device=yseq.device)[None, :] < ctc_lens.to(yseq.device)[:, None]
+        keep &= yseq != self.blank_id
+        keep[:, 1:] &= yseq[:, 1:] != yseq[:, :-1]
+        counts = keep.sum(dim=1)
+        flat = torch.cat((counts, yseq[keep])).tolist()
+        token_lists, offset = [], b
+        for count in flat[:b]:
+            token_lists.append(flat[offset : offset + count])
+            offset += count
+        return token_lists
+
+    @staticmethod
+    def decode_tokens(token_lists, tokenizer):
+        # sentencepiece can decode the whole batch in one call
+        sp = getattr(tokenizer, "sp", None)
+        if sp is not None and len(token_lists) > 1:
+            return sp.DecodeIds(token_lists)
+        return [tokenizer.decode(token_int) for token_int in token_lists]
+
+    def inference_chunk(
+        self,
+        speech: torch.Tensor,
+        cache: dict,
+        chunk_size: tuple,
+        look_back: int = -1,
+        tokenizer=None,
+        **kwargs,
+    ):
+        """Streaming CTC decoding of one chunk of fbank features.
+
+        Args:
+            speech: (T, D) or (1, T, D) features, the last chunk_size[2] frames being lookahead.
+            cache: per-session state, an empty dict for the first chunk of a session.
+            chunk_size: (0, chunk, lookahead), lookahead should be 0 only for the last chunk.
+
+        Returns:
+            The text decoded so far, including the language/emotion/event tags.
+        """
+        if len(speech.shape) < 3:
+            speech = speech[None, :, :]
+        speech = speech.to(device=kwargs["device"])
+
+        if not cache.get("started", False):
+            # the first chunk carries the same query frames as the offline inference
+            textnorm = kwargs.get("text_norm", None)
+            if textnorm is None:
+                textnorm = "withitn" if kwargs.get("use_itn", False) else "woitn"
+            input_query = self.query_embedding(kwargs.get("language", "auto"), textnorm, speech.device)
+            speech = torch.cat((input_query, speech), dim=1)
+            cache.update({"started": True, "offset": 0, "layers": None, "tokens": [], "last": None})
+
+        encoder_out = self.encoder.forward_chunk(speech, cache, chunk_size, look_back)
+        if chunk_size[2] > 0:
+            encoder_out = encoder_out[:, : -chunk_size[2], :]
+
+        ctc_logits = self.ctc.log_softmax(encoder_out)
+        if kwargs.get("ban_emo_unk", False):
+            ctc_logits[:, :, self.emo_dict["unk"]] = -float("inf")
+
+        # collapse repeats across chunk boundaries as well, then drop blanks
+        for token in ctc_logits[0].argmax(dim=-1).tolist():
+            if token != cache["last"] and token != self.blank_id:
+                cache["tokens"].append(token)
+            cache["last"] = token
+
+        return tokenizer.decode(cache["tokens"])
+
     def export(self, **kwargs):
         from export_meta import export_rebuild_model
 
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import os
+from typing import List, Optional
+
+import numpy as np
+import torch
+from funasr.utils.load_utils import extract_fbank
+
+# 每次送入编码器的 LFR 帧数（每帧 60ms），默认 10 帧即每 600ms 音频更新一次结果
+ASR_STREAM_CHUNK_FRAMES = int(os.getenv("ASR_STREAM_CHUNK_FRAMES", "10"))
+# 每个块额外携带的右侧上下文帧数，这部分会随下一个块重新编码，至少为 1
+ASR_STREAM_LOOKAHEAD_FRAMES = max(1, int(os.getenv("ASR_STREAM_LOOKAHEAD_FRAMES", "5")))
+# 注意力回看的块数，决定每层 key/value 缓存的长度；-1 表示回看整个会话（缓存随会话时长增长），0 表示每个块独立编码
+ASR_STREAM_LOOK_BACK = int(os.getenv("ASR_STREAM_LOOK_BACK", "20"))
+# 结束时是否对整段音频再做一次离线识别作为最终结果，0 表示直接使用流式结果，不再保留会话音频
+ASR_STREAM_RESCORE = os.getenv("ASR_STREAM_RESCORE", "1") == "1"
+# 单个会话最多接收的音频时长（秒），超出后返回错误并关闭连接，0 表示不限制
+ASR_STREAM_MAX_SECONDS = float(os.getenv("ASR_STREAM_MAX_SECONDS", "600"))
+
+
+class StreamLimitExceeded(Exception):
+    pass
+
+
+class StreamSession(object):
+    """
+    单个流式会话的状态：接收 16k 单声道 s16le PCM，按块增量计算 LFR 特征，
+    并使用各注意力层的 key/value 缓存逐块编码、做 CTC 贪心解码。只有需要重新识别整段音频时才保留收到的 PCM，
+    回看块数与会话时长都有上限，长连接占用的内存不会无限增长。
+    """
+
+    def __init__(self, model, language: str = "auto", use_itn: bool = True,
+                 chunk_frames: int = ASR_STREAM_CHUNK_FRAMES, lookahead_frames: int = ASR_STREAM_LOOKAHEAD_FRAMES,
+                 look_back: int = ASR_STREAM_LOOK_BACK, keep_audio: bool = ASR_STREAM_RESCORE,
+                 max_seconds: float = ASR_STREAM_MAX_SECONDS):
+        self.model = model
+        self.language = language
+        self.use_itn = use_itn
+        self.chunk_size = (0, chunk_frames, lookahead_frames)
+        self.look_back = look_back
+        self.kwargs = dict(model.kwargs)
+        self.kwargs.pop("cache", None)
+        self.kwargs.update({"language": language, "use_itn": use_itn})
+
+        frontend = model.kwargs["frontend"]
+        self.frontend = frontend
+        self.frame_shift = int(frontend.fs * frontend.frame_shift / 1000)
+        self.frame_length = int(frontend.fs * frontend.frame_length / 1000)
+        # LFR 帧 i 由 fbank 帧 [i * lfr_n - left, i * lfr_n + left] 拼接而成
+        self.lfr_n = frontend.lfr_n
+        self.lfr_left = (frontend.lfr_m - 1) // 2
+
+        self.keep_audio = keep_audio
+        self.max_seconds = max_seconds
+        self.max_samples = int(max_seconds * frontend.fs)
+        self.samples = 0
+        self.chunks: List[np.ndarray] = []
+        self.remainder = b""
+        # 尚未计算特征的音频窗口，以及窗口起点在整段音频中的采样点位置
+        self.window = np.zeros(0, dtype=np.float32)
+        self.window_start = 0
+        # 下一个待编码（含上一块的右侧上下文）的 LFR 帧序号
+        self.frame = 0
+        self.cache = {}
+        self.text = ""
+
+    def audio(self) -> np.ndarray:
+        if len(self.chunks) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self.chunks)
+
+    def _stable_frames(self, total_samples: int, final: bool) -> int:
+        if total_samples < self.frame_length:
+            return 0
+        fbank_frames = 1 + (total_samples - self.frame_length) // self.frame_shift
+        if final:
+            return (fbank_frames + self.lfr_n - 1) // self.lfr_n
+        # 右侧拼接的 fbank 帧还没到齐的 LFR 帧会被补齐，暂不使用
+        return max(0, (fbank_frames - 1 - self.lfr_left) // self.lfr_n + 1)
+
+    def _features(self, final: bool) -> Optional[torch.Tensor]:
+        total_samples = self.window_start + len(self.window)
+        if self._stable_frames(total_samples, final) <= self.frame or len(self.window) < self.frame_length:
+            return None
+        feats, _ = extract_fbank(torch.from_numpy(self.window), data_type="sound", frontend=self.frontend)
+        feats = feats[0]
+        # 窗口从 LFR 帧 frame - 1 对应的 fbank 帧开始，第一帧的左侧是补齐的，丢弃
+        if self.frame > 0:
+            feats = feats[1:]
+        return feats[:self._stable_frames(total_samples, final) - self.frame]
+
+    def feed(self, data: bytes, final: bool = False) -> Optional[str]:
+        """追加一段 PCM 并编码所有已凑齐的块，结果有更新时返回当前的完整文本（含标签）。"""
+        data = self.remainder + data
+        self.remainder = data[len(data) // 2 * 2:]
+        pcm = np.frombuffer(data, dtype=np.int16, count=len(data) // 2).astype(np.float32) / 32768
+        self.samples += len(pcm)
+        if 0 < self.max_samples < self.samples:
+            raise StreamLimitExceeded("音频时长超过单个会话的上限 {:g} 秒".format(self.max_seconds))
+        if len(pcm) > 0:
+            if self.keep_audio:
+                self.chunks.append(pcm)
+            self.window = np.concatenate([self.window, pcm])
+
+        feats = self._features(final)
+        if feats is None:
+            if not final or self.cache.get("started", False):
+                return None
+            feats = torch.zeros(0, self.frontend.output_size())
+
+        _, chunk, lookahead = self.chunk_size
+        position = 0
+        text = None
+        with torch.no_grad():
+            while len(feats) - position >= chunk + lookahead:
+                text = self.model.model.inference_chunk(
+                    feats[position:position + chunk + lookahead], self.cache, self.chunk_size, self.look_back,
+                    **self.kwargs)
+                position += chunk
+            if final and (position < len(feats) or not self.cache.get("started", False)):
+                text = self.model.model.inference_chunk(
+                    feats[position:], self.cache, (0, chunk, 0), self.look_back, **self.kwargs)
+                position = len(feats)
+
+        self.frame += position
+        # 只保留计算后续特征所需的音频
+        start = max(self.frame - 1, 0) * self.lfr_n * self.frame_shift
+        self.window = self.window[start - self.window_start:]
+        self.window_start = start
+
+        if text is None or text == self.text:
+            return None
+        self.text = text
+        return text
+
+    def finish(self) -> str:
+        """编码剩余的帧，返回流式识别的最终文本。"""
+        self.feed(b"", final=True)
+        return self.text
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# fastapi 与 grpc 服务共用的音频编码：16bit PCM 转为各种 response_format，并缓存编码结果
+
+import asyncio
+import hashlib
+import os
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 编码线程数，mp3/opus 等格式每个任务占用一个 ffmpeg 进程
+TTS_ENCODE_WORKERS = int(os.getenv("TTS_ENCODE_WORKERS", "4"))
+# 编码结果缓存的大小上限，单位 MB，0 表示关闭缓存
+TTS_AUDIO_CACHE_MB = float(os.getenv("TTS_AUDIO_CACHE_MB", "64"))
+
+# response_format -> (ffmpeg 输出参数, Content-Type)，pcm 与 wav 不经过 ffmpeg
+AUDIO_FORMATS = {
+    "mp3": (["-f", "mp3", "-c:a", "libmp3lame", "-b:a", "128k"], "audio/mpeg"),
+    "opus": (["-f", "ogg", "-c:a", "libopus", "-ar", "24000", "-b:a", "32k"], "audio/ogg"),
+    "aac": (["-f", "adts", "-c:a", "aac", "-b:a", "128k"], "audio/aac"),
+    "flac": (["-f", "flac", "-c:a", "flac"], "audio/flac"),
+    "wav": (None, "audio/wav"),
+    "pcm": (None, "audio/pcm"),
+}
+
+CHUNK_SIZE = 16384
+
+
+class AudioEncodeError(RuntimeError):
+    pass
+
+
+def to_pcm16(speech):
+    return (speech.squeeze(0).clamp(-1, 1).numpy() * (2**15 - 1)).astype(np.int16).tobytes()
+
+
+def wav_header(rate, size=0xFFFFFFFF):
+    # 流式 wav 事先不知道长度，数据长度按最大值填写，播放器会一直读到流结束
+    return (b"RIFF" + struct.pack("<I", min(size + 36, 0xFFFFFFFF)) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, rate, rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", size))
+
+
+def finalize(content, response_format):
+    """流式输出的内容拼接完整后，补上 wav 的真实 RIFF/data 长度。"""
+    if response_format == "wav" and len(content) >= 44:
+        content = content[:4] + struct.pack("<I", len(content) - 8) + content[8:40] \
+            + struct.pack("<I", len(content) - 44) + content[44:]
+    return content
+
+
+def ffmpeg_command(response_format, rate):
+    return ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0",
+            *AUDIO_FORMATS[response_format][0], "-flush_packets", "1", "pipe:1"]
+
+
+def encode(pcm, response_format, rate):
+    """将完整的 16bit PCM 编码为 response_format。"""
+    if response_format == "pcm":
+        return pcm
+    if response_format == "wav":
+        return wav_header(rate, len(pcm)) + pcm
+    process = subprocess.run(ffmpeg_command(response_format, rate), input=pcm, capture_output=True)
+    if process.returncode != 0:
+        raise AudioEncodeError("音频编码失败: {}".format(process.stderr.decode(errors="ignore").strip()))
+    return process.stdout
+
+
+def iter_encode(pcm_chunks, response_format, rate):
+    """同步版本的流式编码，由写入线程向 ffmpeg 送入 PCM，当前线程读取编码结果。"""
+    if AUDIO_FORMATS[response_format][0] is None:
+        if response_format == "wav":
+            yield wav_header(rate)
+        for pcm in pcm_chunks:
+            yield pcm
+        return
+
+    process = subprocess.Popen(ffmpeg_command(response_format, rate), stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    errors = []
+
+    def feed():
+        try:
+            for pcm in pcm_chunks:
+                process.stdin.write(pcm)
+                process.stdin.flush()
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            chunk = process.stdout.read1(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        feeder.join()
+        if len(errors) > 0:
+            raise errors[0]
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+async def encode_stream(pcm_chunks, response_format, rate):
+    """将 PCM 流按 response_format 编码，mp3/opus 等通过 ffmpeg 管道边编码边输出。"""
+    if AUDIO_FORMATS[response_format][0] is None:
+        if response_format == "wav":
+            yield wav_header(rate)
+        async for pcm in pcm_chunks:
+            yield pcm
+        return
+
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command(response_format, rate), stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+
+    async def feed():
+        try:
+            async for pcm in pcm_chunks:
+                process.stdin.write(pcm)
+                await process.stdin.drain()
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.ensure_future(feed())
+    try:
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        await feeder
+    finally:
+        if not feeder.done():
+            feeder.cancel()
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+
+
+class AudioCache(object):
+    """编码结果的 LRU 缓存，按字节数淘汰。键由合成模式、文本、音色与格式的内容哈希组成。"""
+
+    def __init__(self, max_mb=TTS_AUDIO_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            # 带上长度，避免不同的切分拼出相同的字节串
+            digest.update(struct.pack("<Q", len(data)))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            content = self.items.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        if not self.enabled or len(content) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.bytes -= len(self.items.pop(key))
+            self.items[key] = content
+            self.bytes += len(content)
+            while self.bytes > self.max_bytes:
+                _, old = self.items.popitem(last=False)
+                self.bytes -= len(old)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.items), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class AudioEncoder(object):
+    """共享的编码阶段：整段编码在专用线程池中执行，不占用推理线程与事件循环。"""
+
+    def __init__(self, workers=TTS_ENCODE_WORKERS, cache_mb=TTS_AUDIO_CACHE_MB):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+        self.cache = AudioCache(cache_mb)
+
+    def submit(self, pcm, response_format, rate):
+        return self.executor.submit(encode, pcm, response_format, rate)
+
+    async def run(self, pcm, response_format, rate):
+        return await asyncio.wrap_future(self.submit(pcm, response_format, rate))
@@ -6,33 +6,282 @@
 # fastapi run --port 6006 fastapi_server.py
 
 import os
+import re
 import sys
-import io,time
-from fastapi import FastAPI, Request, Response, File, UploadFile, Form, Body
-from fastapi.responses import HTMLResponse
+import time
+import asyncio
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Request, Response, File, UploadFile, Form, Body, HTTPException
+from fastapi.responses import HTMLResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware  #引入 CORS中间件模块
 from contextlib import asynccontextmanager
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append('{}/../../..'.format(ROOT_DIR))
 sys.path.append('{}/../../../third_party/Matcha-TTS'.format(ROOT_DIR))
+sys.path.append('{}/..'.format(ROOT_DIR))
 from cosyvoice.cli.cosyvoice import CosyVoice
 from cosyvoice.utils.file_utils import load_wav
-import numpy as np
+from audio_encoding import AUDIO_FORMATS, AudioEncoder, encode_stream, finalize, to_pcm16
 import torch
-import torchaudio
 import logging
 from pydantic import BaseModel
 logging.getLogger('matplotlib').setLevel(logging.WARNING)
 
+# 流式合成时按句切分，过短的句子与后一句合并，过长的句子在逗号处再切开
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "8"))
+TTS_SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", "80"))
+
+SENTENCE_END = re.compile(r'(?<=[。！？!?；;…\n])|(?<=[.])(?=\s)')
+CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+
+# 推理线程数，模型不是线程安全的，默认 1
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "1"))
+# 同时接受的合成请求数（执行中 + 排队），超出返回 429
+TTS_MAX_PENDING = int(os.getenv("TTS_MAX_PENDING", "16"))
+# 单个请求的最长处理时间，单位秒，超时返回 504；流式返回时按每句合成计时
+TTS_TIMEOUT_SECONDS = float(os.getenv("TTS_TIMEOUT_SECONDS", "120"))
+
+# 注册音色：内存中保留的音色数与磁盘目录，磁盘上最多保存的音色数，超出时删除最久未用的
+TTS_VOICE_CACHE_SIZE = int(os.getenv("TTS_VOICE_CACHE_SIZE", "64"))
+TTS_VOICE_DIR = os.getenv("TTS_VOICE_DIR", os.path.join(ROOT_DIR, "voices"))
+TTS_VOICE_DISK_LIMIT = int(os.getenv("TTS_VOICE_DISK_LIMIT", "1000"))
+
+VOICE_ID = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
 class LaunchFailed(Exception):
     pass
 
+class Ticket(object):
+    """一个已准入的请求，release 可重复调用。deadline 为 None 时每个任务单独计时。"""
+
+    def __init__(self, pool, deadline):
+        self.pool = pool
+        self.deadline = deadline
+        self.released = False
+
+    def remaining(self):
+        return self.deadline - asyncio.get_running_loop().time()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.pool.pending -= 1
+
+class InferencePool(object):
+    """
+    专用的推理线程池：合成在线程中执行，不阻塞事件循环；准入的请求数有上限，满了直接返回 429，
+    每个请求有总的超时时间。流式返回的请求改为每个任务单独计时：响应开始发送后无法再返回 504，
+    整体计时会让长文本在中途被截断。
+    """
+
+    def __init__(self, workers=TTS_WORKERS, max_pending=TTS_MAX_PENDING, timeout=TTS_TIMEOUT_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.queued = 0
+        self.running = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def admit(self, per_job=False):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many synthesis requests, please retry later",
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        if per_job:
+            return Ticket(self, None)
+        return Ticket(self, asyncio.get_running_loop().time() + self.timeout)
+
+    def _call(self, fn, args, on_start):
+        on_start()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def _done(self, future):
+        # 超时前尚未开始执行的任务被取消，不会进入 _call
+        if future.cancelled():
+            with self.lock:
+                self.queued -= 1
+
+    @staticmethod
+    def _started(started):
+        if not started.done():
+            started.set_result(None)
+
+    async def run(self, ticket, fn, *args):
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+        with self.lock:
+            self.queued += 1
+        future = self.executor.submit(self._call, fn, args,
+                                      lambda: loop.call_soon_threadsafe(self._started, started))
+        future.add_done_callback(self._done)
+        try:
+            if ticket.deadline is None:
+                # 排队与执行分别计时，预取的下一句排在本请求上一句之后，等待时间不计入自己的执行时间
+                try:
+                    await asyncio.wait_for(started, self.timeout)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    future.cancel()
+                    raise
+                return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+            return await asyncio.wait_for(asyncio.wrap_future(future), max(ticket.remaining(), 0))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HTTPException(status_code=504, detail="Synthesis timed out")
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "queued": self.queued,
+            "running": self.running,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+pool = InferencePool()
+encoder = AudioEncoder()
+
+class Voice(object):
+    def __init__(self, voice_id, prompt_text, prompt_speech_16k, spk_info, digest=None):
+        self.voice_id = voice_id
+        self.prompt_text = prompt_text
+        self.prompt_speech_16k = prompt_speech_16k
+        # CosyVoice 前端提取的说话人向量、prompt 语音 token 与声学特征，旧版 CosyVoice 为 None
+        self.spk_info = spk_info
+        # prompt 文本与音频的哈希，同一 voice_id 重新注册后编码结果缓存不会命中旧的音频
+        self.digest = digest or voice_id
+
+class VoiceRegistry(object):
+    """
+    注册音色的缓存：prompt 特征只在注册时提取一次，内存中按 LRU 保留 TTS_VOICE_CACHE_SIZE 个，
+    同时落盘到 TTS_VOICE_DIR，内存淘汰或重启后从磁盘加载。
+    """
+
+    def __init__(self, directory=TTS_VOICE_DIR, cache_size=TTS_VOICE_CACHE_SIZE, disk_limit=TTS_VOICE_DISK_LIMIT):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.disk_limit = disk_limit
+        self.lock = threading.Lock()
+        self.voices = OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, voice_id):
+        return os.path.join(self.directory, voice_id + ".pt")
+
+    def _remember(self, voice):
+        with self.lock:
+            self.voices[voice.voice_id] = voice
+            self.voices.move_to_end(voice.voice_id)
+            while len(self.voices) > self.cache_size:
+                self.voices.popitem(last=False)
+
+    def put(self, voice):
+        torch.save({"prompt_text": voice.prompt_text, "prompt_speech_16k": voice.prompt_speech_16k,
+                    "spk_info": voice.spk_info, "digest": voice.digest}, self.path(voice.voice_id))
+        self._remember(voice)
+        names = [name for name in os.listdir(self.directory) if name.endswith(".pt")]
+        if len(names) > self.disk_limit:
+            names.sort(key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+            for name in names[:len(names) - self.disk_limit]:
+                self.delete(name[:-3])
+
+    def get(self, voice_id):
+        if not VOICE_ID.match(voice_id):
+            return None
+        with self.lock:
+            voice = self.voices.get(voice_id)
+            if voice is not None:
+                self.voices.move_to_end(voice_id)
+        path = self.path(voice_id)
+        if voice is None:
+            if not os.path.exists(path):
+                return None
+            data = torch.load(path, map_location=getattr(app.cosyvoice.frontend, "device", "cpu"))
+            voice = Voice(voice_id, data["prompt_text"], data["prompt_speech_16k"], data["spk_info"], data.get("digest"))
+            self._remember(voice)
+        # 磁盘按修改时间淘汰，使用时刷新
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return voice
+
+    def delete(self, voice_id):
+        with self.lock:
+            self.voices.pop(voice_id, None)
+        try:
+            os.remove(self.path(voice_id))
+            return True
+        except OSError:
+            return False
+
+    def list(self):
+        return sorted(name[:-3] for name in os.listdir(self.directory) if name.endswith(".pt"))
+
+def voice_digest(prompt_text, prompt_speech_16k):
+    digest = hashlib.sha1(prompt_text.encode("utf-8"))
+    digest.update(prompt_speech_16k.numpy().tobytes())
+    return digest.hexdigest()
+
+def extract_voice(voice_id, prompt_text, prompt_speech_16k, digest):
+    cosyvoice = app.cosyvoice
+    if not hasattr(cosyvoice, "add_zero_shot_spk"):
+        return Voice(voice_id, prompt_text, prompt_speech_16k, None, digest)
+    key = "register-{}-{}".format(voice_id, threading.get_ident())
+    cosyvoice.add_zero_shot_spk(prompt_text, prompt_speech_16k, key)
+    return Voice(voice_id, prompt_text, prompt_speech_16k, cosyvoice.frontend.spk2info.pop(key), digest)
+
+def inference_voice(tts_text, voice, mode="zero_shot"):
+    """使用注册音色合成，直接复用已提取的 prompt 特征。"""
+    cosyvoice = app.cosyvoice
+    kwargs = {}
+    key = None
+    if voice.spk_info is not None:
+        key = "voice-{}-{}".format(voice.voice_id, threading.get_ident())
+        cosyvoice.frontend.spk2info[key] = dict(voice.spk_info)
+        kwargs["zero_shot_spk_id"] = key
+    try:
+        if mode == "cross_lingual" and key is not None:
+            # 跨语种合成会删除 spk2info 条目中的 prompt 文本，而模型内部按句切分后每句都会重新读取该条目，
+            # 每产出一段音频就放入一份新的拷贝，下一句读到的仍是完整的条目
+            speeches = []
+            for output in cosyvoice.inference_cross_lingual(tts_text, voice.prompt_speech_16k, **kwargs):
+                speeches.append(output['tts_speech'])
+                cosyvoice.frontend.spk2info[key] = dict(voice.spk_info)
+            return torch.concat(speeches, dim=1)
+        if mode == "cross_lingual":
+            return synthesize(cosyvoice.inference_cross_lingual, tts_text, voice.prompt_speech_16k, **kwargs)
+        return synthesize(cosyvoice.inference_zero_shot, tts_text, voice.prompt_text, voice.prompt_speech_16k,
+                          **kwargs)
+    finally:
+        if key is not None:
+            cosyvoice.frontend.spk2info.pop(key, None)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     model_dir = os.getenv("MODEL_DIR", "pretrained_models/CosyVoice-300M-SFT")
     if model_dir:
         logging.info("MODEL_DIR is {}", model_dir)
         app.cosyvoice = CosyVoice(model_dir)
+        app.voices = VoiceRegistry()
         # sft usage
         logging.info("Avaliable speakers {}", app.cosyvoice.list_avaliable_spks())
     else:
@@ -50,71 +299,228 @@ app.add_middleware(
     allow_methods=["*"],  # 设置允许跨域的http方法，比如 get、post、put等。
     allow_headers=["*"])  #允许跨域的headers，可以用来鉴别来源等作用。
 
-def buildResponse(output):
-    buffer = io.BytesIO()
-    torchaudio.save(buffer, output, 22050, format="mp3")
-    buffer.seek(0)
-    return Response(content=buffer.read(-1), media_type="audio/mpeg")
+def buildResponse(content, response_format="mp3"):
+    return Response(content=content, media_type=AUDIO_FORMATS[response_format][1])
+
+def check_format(response_format):
+    response_format = response_format.lower()
+    if response_format not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported response_format, use one of {}".format(
+            ", ".join(AUDIO_FORMATS)))
+    return response_format
+
+def synthesize(method, *args, **kwargs):
+    """兼容两种 CosyVoice 接口：旧版直接返回 {'tts_speech': tensor}，新版返回按段产出的生成器。"""
+    output = method(*args, **kwargs)
+    if torch.is_tensor(output):
+        return output
+    if isinstance(output, dict):
+        return output['tts_speech']
+    return torch.concat([item['tts_speech'] for item in output], dim=1)
+
+def sample_rate():
+    return getattr(app.cosyvoice, "sample_rate", 22050)
+
+def split_sentences(text):
+    """按句切分待合成文本，第一段尽量短，以便尽早返回首段音频。"""
+    segments = []
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) > TTS_SEGMENT_MAX_CHARS:
+            segments.extend(CLAUSE_END.split(sentence))
+        else:
+            segments.append(sentence)
+    merged = []
+    for segment in segments:
+        if merged and (len(merged[-1].strip()) < TTS_SEGMENT_MIN_CHARS
+                       or len(segment.strip()) == 0) and len(merged[-1]) + len(segment) <= TTS_SEGMENT_MAX_CHARS:
+            merged[-1] += segment
+        else:
+            merged.append(segment)
+    return [segment.strip() for segment in merged if segment.strip()]
+
+async def synthesize_stream(ticket, method, sentences, *args):
+    """逐句合成，当前句发送的同时合成下一句，产出 16bit PCM。"""
+    next_task = None
+    try:
+        for index, sentence in enumerate(sentences):
+            task = next_task or asyncio.ensure_future(pool.run(ticket, synthesize, method, sentence, *args))
+            next_task = None
+            if index + 1 < len(sentences):
+                next_task = asyncio.ensure_future(pool.run(ticket, synthesize, method, sentences[index + 1], *args))
+            yield to_pcm16(await task)
+    finally:
+        if next_task is not None:
+            next_task.cancel()
+        ticket.release()
+
+async def run_job(fn, *args):
+    """在推理线程池中执行一个任务，请求数超限时返回 429。"""
+    ticket = pool.admit()
+    try:
+        return await pool.run(ticket, fn, *args)
+    finally:
+        ticket.release()
+
+async def infer(method, *args):
+    return await run_job(synthesize, method, *args)
+
+def cache_key(endpoint, response_format, *parts):
+    """缓存键包含接口名与所有影响输出的参数，不同接口的合成方式不同，不能共用结果。"""
+    return encoder.cache.key(endpoint, response_format, *parts)
+
+async def cached_audio(endpoint, response_format, key_parts, method, *args):
+    """相同的 (接口, 合成模式, 文本, 音色, 格式) 直接返回缓存的编码结果，未命中时合成并在编码线程池中编码。"""
+    key = cache_key(endpoint, response_format, *key_parts)
+    content = encoder.cache.get(key)
+    if content is None:
+        output = await infer(method, *args)
+        content = await encoder.run(to_pcm16(output), response_format, sample_rate())
+        encoder.cache.put(key, content)
+    return buildResponse(content, response_format)
+
+async def cache_stream(audio, key, response_format):
+    """边发送边收集流式输出，完整发送后写入缓存。"""
+    chunks = []
+    async for chunk in audio:
+        chunks.append(chunk)
+        yield chunk
+    encoder.cache.put(key, finalize(b"".join(chunks), response_format))
 
 @app.post("/api/inference/sft")
 @app.get("/api/inference/sft")
-async def sft(tts: str = Form(), role: str = Form()):
+async def sft(tts: str = Form(), role: str = Form(), response_format: str = Form("mp3")):
+    response_format = check_format(response_format)
     start = time.process_time()
-    output = app.cosyvoice.inference_sft(tts, role)
+    response = await cached_audio("sft", response_format, ("sft", tts, role), app.cosyvoice.inference_sft, tts, role)
     end = time.process_time()
     logging.info("infer time is {} seconds", end-start)
-    return buildResponse(output['tts_speech'])
+    return response
 
 class SpeechRequest(BaseModel):
     model: str
     input: str
     voice: str
+    response_format: str = "mp3"
+    # 默认按句流式返回，首段音频合成完即开始发送
+    stream: bool = True
 
 @app.post("/v1/audio/speech")
-async def sft(request: Request, speech_request: SpeechRequest):
-    # 解析请求体中的JSON数据
+async def speech(request: Request, speech_request: SpeechRequest):
     data = speech_request.dict()
-    
+    response_format = check_format(data['response_format'])
+    sentences = split_sentences(data['input'])
+    if len(sentences) == 0:
+        raise HTTPException(status_code=400, detail="input is empty")
+
+    voice = None
+    if data['voice'] not in app.cosyvoice.list_avaliable_spks():
+        voice = await run_in_threadpool(app.voices.get, data['voice'])
+    if voice is not None:
+        key = cache_key("speech", response_format, "zero_shot", data['input'], voice.digest)
+    else:
+        key = cache_key("speech", response_format, "sft", data['input'], data['voice'])
+    content = encoder.cache.get(key)
+    if content is not None:
+        return buildResponse(content, response_format)
+
+    ticket = pool.admit(per_job=data['stream'])
+    if voice is not None:
+        pcm_chunks = synthesize_stream(ticket, inference_voice, sentences, voice)
+    else:
+        pcm_chunks = synthesize_stream(ticket, app.cosyvoice.inference_sft, sentences, data['voice'])
+    if data['stream']:
+        audio = cache_stream(encode_stream(pcm_chunks, response_format, sample_rate()), key, response_format)
+        # 客户端在开始读取前断开时生成器不会执行，由后台任务兜底释放名额
+        return StreamingResponse(audio, media_type=AUDIO_FORMATS[response_format][1],
+                                 background=BackgroundTask(ticket.release))
+
     start = time.process_time()
-    output = app.cosyvoice.inference_sft(data['input'], data['voice'])
-    end = time.process_time()
-    logging.info("infer time is {} seconds", end-start)
-    return buildResponse(output['tts_speech'])
+    pcm = b"".join([chunk async for chunk in pcm_chunks])
+    content = await encoder.run(pcm, response_format, sample_rate())
+    logging.info("infer time is {} seconds", time.process_time() - start)
+    encoder.cache.put(key, content)
+    return buildResponse(content, response_format)
+
+async def load_prompt(audio, voice_id):
+    """读取上传的 prompt 音频，或按 voice_id 取出已注册的音色。"""
+    if voice_id:
+        voice = await run_in_threadpool(app.voices.get, voice_id)
+        if voice is None:
+            raise HTTPException(status_code=404, detail="Voice {} is not registered".format(voice_id))
+        return None, voice
+    if audio is None:
+        raise HTTPException(status_code=400, detail="Either audio or voice_id is required")
+    return await run_in_threadpool(load_wav, audio.file, 16000), None
 
 @app.post("/api/inference/zero-shot")
-async def zeroShot(tts: str = Form(), prompt: str = Form(), audio: UploadFile = File()):
+async def zeroShot(tts: str = Form(), prompt: str = Form(""), audio: UploadFile = File(None),
+                   voice_id: str = Form(None), response_format: str = Form("mp3")):
+    response_format = check_format(response_format)
     start = time.process_time()
-    prompt_speech = load_wav(audio.file, 16000)
-    prompt_audio = (prompt_speech.numpy() * (2**15)).astype(np.int16).tobytes()
-    prompt_speech_16k = torch.from_numpy(np.array(np.frombuffer(prompt_audio, dtype=np.int16))).unsqueeze(dim=0)
-    prompt_speech_16k = prompt_speech_16k.float() / (2**15)
-
-    output = app.cosyvoice.inference_zero_shot(tts, prompt, prompt_speech_16k)
+    prompt_speech_16k, voice = await load_prompt(audio, voice_id)
+    if voice is not None:
+        response = await cached_audio("zero-shot", response_format, ("zero_shot", tts, voice.digest), inference_voice, tts, voice)
+    else:
+        response = await cached_audio("zero-shot", response_format, ("zero_shot", tts, voice_digest(prompt, prompt_speech_16k)),
+                                      app.cosyvoice.inference_zero_shot, tts, prompt, prompt_speech_16k)
     end = time.process_time()
     logging.info("infer time is {} seconds", end-start)
-    return buildResponse(output['tts_speech'])
+    return response
 
 @app.post("/api/inference/cross-lingual")
-async def crossLingual(tts: str = Form(), audio: UploadFile = File()):
+async def crossLingual(tts: str = Form(), audio: UploadFile = File(None), voice_id: str = Form(None),
+                       response_format: str = Form("mp3")):
+    response_format = check_format(response_format)
     start = time.process_time()
-    prompt_speech = load_wav(audio.file, 16000)
-    prompt_audio = (prompt_speech.numpy() * (2**15)).astype(np.int16).tobytes()
-    prompt_speech_16k = torch.from_numpy(np.array(np.frombuffer(prompt_audio, dtype=np.int16))).unsqueeze(dim=0)
-    prompt_speech_16k = prompt_speech_16k.float() / (2**15)
-
-    output = app.cosyvoice.inference_cross_lingual(tts, prompt_speech_16k)
+    prompt_speech_16k, voice = await load_prompt(audio, voice_id)
+    if voice is not None:
+        response = await cached_audio("cross-lingual", response_format, ("cross_lingual", tts, voice.digest),
+                                      inference_voice, tts, voice, "cross_lingual")
+    else:
+        response = await cached_audio("cross-lingual", response_format, ("cross_lingual", tts, voice_digest("", prompt_speech_16k)),
+                                      app.cosyvoice.inference_cross_lingual, tts, prompt_speech_16k)
     end = time.process_time()
     logging.info("infer time is {} seconds", end-start)
-    return buildResponse(output['tts_speech'])
+    return response
+
+@app.post("/api/voices")
+async def registerVoice(audio: UploadFile = File(), prompt_text: str = Form(""), voice_id: str = Form(None)):
+    """注册音色，prompt_text 为 prompt 音频对应的文本，只用于跨语种合成时可以为空。"""
+    prompt_speech_16k = await run_in_threadpool(load_wav, audio.file, 16000)
+    digest = voice_digest(prompt_text, prompt_speech_16k)
+    if not voice_id:
+        voice_id = digest[:16]
+    elif not VOICE_ID.match(voice_id):
+        raise HTTPException(status_code=400, detail="voice_id may only contain letters, digits, '_' and '-'")
+    voice = await run_job(extract_voice, voice_id, prompt_text, prompt_speech_16k, digest)
+    await run_in_threadpool(app.voices.put, voice)
+    return {"voice_id": voice_id}
+
+@app.get("/api/voices")
+async def listVoices():
+    return {"voices": await run_in_threadpool(app.voices.list)}
+
+@app.delete("/api/voices/{voice_id}")
+async def deleteVoice(voice_id: str):
+    if not VOICE_ID.match(voice_id) or not await run_in_threadpool(app.voices.delete, voice_id):
+        raise HTTPException(status_code=404, detail="Voice {} is not registered".format(voice_id))
+    return {"voice_id": voice_id}
 
 @app.post("/api/inference/instruct")
 @app.get("/api/inference/instruct")
-async def instruct(tts: str = Form(), role: str = Form(), instruct: str = Form()):
+async def instruct(tts: str = Form(), role: str = Form(), instruct: str = Form(),
+                   response_format: str = Form("mp3")):
+    response_format = check_format(response_format)
     start = time.process_time()
-    output = app.cosyvoice.inference_instruct(tts, role, instruct)
+    response = await cached_audio("instruct", response_format, ("instruct", tts, role, instruct),
+                                  app.cosyvoice.inference_instruct, tts, role, instruct)
     end = time.process_time()
     logging.info("infer time is {} seconds", end-start)
-    return buildResponse(output['tts_speech'])
+    return response
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "queue": pool.stats(), "audio_cache": encoder.cache.stats()}
 
 @app.get("/api/roles")
 async def roles():
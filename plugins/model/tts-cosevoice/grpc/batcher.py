@@ -0,0 +1,241 @@
+import logging
+import threading
+from collections import deque
+
+import torch
+import torch.nn.functional as F
+
+# 与 TransformerLM.inference 的默认参数保持一致
+SAMPLING = 25
+MAX_TOKEN_TEXT_RATIO = 20
+MIN_TOKEN_TEXT_RATIO = 2
+
+
+class LlmJob(object):
+    def __init__(self, text, prompt_text, prompt_speech_token, embedding, tokens):
+        self.inputs = (text, prompt_text, prompt_speech_token, embedding)
+        # 即 model.tts_speech_token_dict[uuid]，生成的 token 直接追加进去供 token2wav 读取
+        self.tokens = tokens
+        self.done = threading.Event()
+        self.error = None
+        self.step = 0
+        self.min_len = 0
+        self.max_len = 0
+        self.next_token = None
+        self.cache = None
+        # 等待超时后调用方已经放弃，调度线程不再为它解码
+        self.cancelled = False
+
+
+class LlmBatcher(object):
+    """
+    跨请求合批的 LLM 解码调度器：接管 CosyVoiceModel.llm_job，所有请求的文本到语音 token 的自回归解码
+    都在一个调度线程里进行。新请求先单独做一次 prefill，之后与其他进行中的请求一起，每一步只做一次
+    批量前向。各请求的 key/value 缓存长度不同，左侧补齐并在注意力里屏蔽补齐的位置；LLM 使用相对位置
+    编码，左侧补齐不改变 query 与各 key 的相对距离，因此结果与逐个解码一致。
+    flow 与 hift（token2wav）仍在各请求自己的线程里执行。
+    """
+
+    def __init__(self, model, max_batch=16, timeout=300):
+        self.model = model
+        self.llm = model.llm
+        self.device = model.device
+        self.fp16 = getattr(model, "fp16", False)
+        self.max_batch = max(1, max_batch)
+        # 单个请求等待解码完成的最长时间（秒），调度线程异常退出时调用方不会一直阻塞
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.waiting = deque()
+        self.active = []
+        # 每层一个 (batch, head, time, d_k * 2) 的缓存，以及 (batch, time) 的有效位置
+        self.caches = []
+        self.valid = None
+        self.original_llm_job = model.llm_job
+        self.supported = self.batchable(self.llm)
+        if self.supported:
+            model.llm_job = self.llm_job
+            threading.Thread(target=self._run, name="llm-batcher", daemon=True).start()
+        else:
+            logging.warning('llm {} does not support batched decoding, requests are decoded one by one'.format(
+                type(self.llm).__name__))
+
+    @staticmethod
+    def batchable(llm):
+        encoder = getattr(llm, "llm", None)
+        if encoder is None or not hasattr(encoder, "encoders") or not hasattr(llm, "llm_decoder"):
+            return False
+        if getattr(encoder, "global_cmvn", None) is not None:
+            return False
+        # 左侧补齐依赖相对位置编码；卷积模块的缓存无法按时间补齐
+        pos_enc = getattr(getattr(encoder, "embed", None), "pos_enc", None)
+        if type(pos_enc).__name__ != "EspnetRelPositionalEncoding":
+            return False
+        return all(getattr(layer, "conv_module", None) is None for layer in encoder.encoders)
+
+    def llm_job(self, text, prompt_text, llm_prompt_speech_token, llm_embedding, uuid):
+        job = LlmJob(text, prompt_text, llm_prompt_speech_token, llm_embedding,
+                     self.model.tts_speech_token_dict[uuid])
+        with self.cond:
+            self.waiting.append(job)
+            self.cond.notify()
+        error = None
+        if job.done.wait(self.timeout):
+            error = job.error
+        else:
+            job.cancelled = True
+            error = TimeoutError('llm decoding did not finish within {} seconds'.format(self.timeout))
+        # 出错时同样结束，避免 tts 一直等待新的 token
+        self.model.llm_end_dict[uuid] = True
+        if error is not None:
+            raise error
+
+    def _run(self):
+        while True:
+            joining = []
+            try:
+                with self.cond:
+                    while len(self.waiting) == 0 and len(self.active) == 0:
+                        self.cond.wait()
+                    while len(self.waiting) > 0 and len(self.active) + len(joining) < self.max_batch:
+                        job = self.waiting.popleft()
+                        if not job.cancelled:
+                            joining.append(job)
+                with torch.inference_mode(), torch.cuda.amp.autocast(self.fp16):
+                    prefilled = []
+                    for job in joining:
+                        try:
+                            if self._prefill(job):
+                                prefilled.append(job)
+                        except Exception as e:
+                            logging.exception('llm prefill failed')
+                            self._finish(job, e)
+                    if len(prefilled) > 0:
+                        self._join(prefilled)
+                    if len(self.active) > 0:
+                        self._step()
+            except Exception as e:
+                # 补齐、拼接缓存或批量前向出错时，结束本轮涉及的所有请求并清空批次，调度线程继续运行
+                logging.exception('llm batched decoding failed')
+                for job in self.active + joining:
+                    self._finish(job, e)
+                self.active, self.caches, self.valid = [], [], None
+
+    def _finish(self, job, error=None):
+        if job.done.is_set():
+            return
+        job.error = error
+        job.cache = None
+        job.done.set()
+
+    def _sample(self, job, logp):
+        """按 TransformerLM.inference 的规则采样第 job.step 步的 token，返回该请求是否继续解码。"""
+        token = self.llm.sampling_ids(logp, job.tokens, SAMPLING,
+                                      ignore_eos=True if job.step < job.min_len else False).item()
+        if token == self.llm.speech_token_size:
+            return False
+        job.tokens.append(token)
+        job.next_token = token
+        job.step += 1
+        return job.step < job.max_len
+
+    def _prefill(self, job):
+        llm = self.llm
+        text, prompt_text, prompt_speech_token, embedding = [tensor.to(self.device) for tensor in job.inputs]
+        job.inputs = None
+        text_len = text.shape[1]
+        job.min_len = int(text_len * MIN_TOKEN_TEXT_RATIO)
+        job.max_len = int(text_len * MAX_TOKEN_TEXT_RATIO)
+        if job.max_len <= 0:
+            self._finish(job)
+            return False
+
+        total_len = torch.tensor([text_len + prompt_text.shape[1]], dtype=torch.int32, device=self.device)
+        text, _ = llm.encode(llm.text_embedding(torch.concat([prompt_text, text], dim=1)), total_len)
+        if embedding.shape[0] != 0:
+            embedding = llm.spk_embed_affine_layer(F.normalize(embedding, dim=1)).unsqueeze(dim=1)
+        else:
+            embedding = torch.zeros(1, 0, llm.llm_input_size, dtype=text.dtype, device=self.device)
+        sos_eos_emb = llm.llm_embedding.weight[llm.sos_eos].reshape(1, 1, -1)
+        task_id_emb = llm.llm_embedding.weight[llm.task_id].reshape(1, 1, -1)
+        if prompt_speech_token.shape[1] != 0:
+            prompt_speech_token_emb = llm.speech_embedding(prompt_speech_token)
+        else:
+            prompt_speech_token_emb = torch.zeros(1, 0, llm.llm_input_size, dtype=text.dtype, device=self.device)
+        lm_input = torch.concat([sos_eos_emb, embedding, text, task_id_emb, prompt_speech_token_emb], dim=1)
+
+        length = lm_input.shape[1]
+        empty = torch.zeros((0, 0, 0, 0), device=self.device)
+        y_pred, job.cache, _ = llm.llm.forward_chunk(
+            lm_input, offset=0, required_cache_size=-1, att_cache=empty, cnn_cache=empty,
+            att_mask=torch.tril(torch.ones((1, length, length), device=self.device)).to(torch.bool))
+        logp = llm.llm_decoder(y_pred[:, -1]).log_softmax(dim=-1)
+        # 第一步不允许结束
+        logp[:, llm.speech_token_size] = -float('inf')
+        if not self._sample(job, logp.squeeze(dim=0)):
+            self._finish(job)
+            return False
+        return True
+
+    def _join(self, jobs):
+        length = max([job.cache.shape[2] for job in jobs] + [0 if self.valid is None else self.valid.shape[1]])
+        valid = [] if self.valid is None else [F.pad(self.valid, (length - self.valid.shape[1], 0))]
+        for job in jobs:
+            row = torch.ones(1, job.cache.shape[2], dtype=torch.bool, device=self.device)
+            valid.append(F.pad(row, (length - row.shape[1], 0)))
+        self.valid = torch.cat(valid, dim=0)
+        caches = []
+        for index in range(len(jobs[0].cache)):
+            rows = [] if len(self.caches) == 0 else [F.pad(self.caches[index], (0, 0, length - self.caches[index].shape[2], 0))]
+            for job in jobs:
+                rows.append(F.pad(job.cache[index:index + 1], (0, 0, length - job.cache.shape[2], 0)))
+            caches.append(torch.cat(rows, dim=0))
+        self.caches = caches
+        for job in jobs:
+            job.cache = None
+        self.active.extend(jobs)
+
+    def _leave(self, keep):
+        if len(keep) == 0:
+            self.active, self.caches, self.valid = [], [], None
+            return
+        index = torch.tensor(keep, device=self.device)
+        valid = self.valid.index_select(0, index)
+        # 去掉剩余请求都不需要的左侧补齐
+        start = int(valid.any(dim=0).nonzero()[0])
+        self.valid = valid[:, start:]
+        self.caches = [cache.index_select(0, index)[:, :, start:] for cache in self.caches]
+        self.active = [self.active[row] for row in keep]
+
+    def _step(self):
+        llm = self.llm
+        encoder = llm.llm
+        batch = len(self.active)
+        tokens = torch.tensor([job.next_token for job in self.active], device=self.device)
+        xs = llm.speech_embedding.weight[tokens].unsqueeze(dim=1)
+        length = self.valid.shape[1]
+        self.valid = torch.cat([self.valid, torch.ones(batch, 1, dtype=torch.bool, device=self.device)], dim=1)
+        mask = self.valid.unsqueeze(dim=1)
+        xs, _, _ = encoder.embed(xs, torch.ones(batch, 1, 1, dtype=torch.bool, device=self.device), 0)
+        # 相对位置编码与绝对位置无关，补齐后的各行共用一份位置表
+        pos_emb = encoder.embed.position_encoding(offset=-length, size=length + 1)
+        for index, layer in enumerate(encoder.encoders):
+            xs, _, self.caches[index], _ = layer(xs, mask, pos_emb, att_cache=self.caches[index])
+        if encoder.normalize_before:
+            xs = encoder.after_norm(xs)
+        logp = llm.llm_decoder(xs[:, -1]).log_softmax(dim=-1)
+
+        keep = []
+        for row, job in enumerate(self.active):
+            if job.cancelled:
+                self._finish(job)
+                continue
+            try:
+                if self._sample(job, logp[row]):
+                    keep.append(row)
+                    continue
+                self._finish(job)
+            except Exception as e:
+                logging.exception('llm sampling failed')
+                self._finish(job, e)
+        if len(keep) < batch:
+            self._leave(keep)
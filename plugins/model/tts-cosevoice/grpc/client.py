@@ -31,6 +31,7 @@ def main():
     with grpc.insecure_channel("{}:{}".format(args.host, args.port)) as channel:
         stub = cosyvoice_pb2_grpc.CosyVoiceStub(channel)
         request = cosyvoice_pb2.Request()
+        request.response_format = args.response_format
         if args.mode == 'sft':
             logging.info('send sft request')
             sft_request = cosyvoice_pb2.sftRequest()
@@ -60,10 +61,17 @@ def main():
             instruct_request.instruct_text = args.instruct_text
             request.instruct_request.CopyFrom(instruct_request)
 
-        response = stub.Inference(request)
+        if args.stream:
+            tts_audio = b''.join(response.tts_audio for response in stub.InferenceStream(request))
+        else:
+            tts_audio = stub.Inference(request).tts_audio
         logging.info('save response to {}'.format(args.tts_wav))
-        tts_speech = torch.from_numpy(np.array(np.frombuffer(response.tts_audio, dtype=np.int16))).unsqueeze(dim=0)
-        torchaudio.save(args.tts_wav, tts_speech, target_sr)
+        if args.response_format == 'pcm':
+            tts_speech = torch.from_numpy(np.array(np.frombuffer(tts_audio, dtype=np.int16))).unsqueeze(dim=0)
+            torchaudio.save(args.tts_wav, tts_speech, target_sr)
+        else:
+            with open(args.tts_wav, 'wb') as f:
+                f.write(tts_audio)
         logging.info('get response')
 
 
@@ -94,6 +102,13 @@ if __name__ == "__main__":
     parser.add_argument('--instruct_text',
                         type=str,
                         default='Theo \'Crimson\', is a fiery, passionate rebel leader. Fights with fervor for justice, but struggles with impulsiveness.')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='receive audio chunks with InferenceStream')
+    parser.add_argument('--response_format',
+                        default='pcm',
+                        choices=['pcm', 'wav', 'mp3', 'opus', 'aac', 'flac'],
+                        help='encoding of the returned audio, pcm is saved as wav')
     parser.add_argument('--tts_wav',
                         type=str,
                         default='demo.wav')
@@ -16,6 +16,7 @@ import sys
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append('{}/../../..'.format(ROOT_DIR))
 sys.path.append('{}/../../../third_party/Matcha-TTS'.format(ROOT_DIR))
+sys.path.append('{}/..'.format(ROOT_DIR))
 from concurrent import futures
 import argparse
 import cosyvoice_pb2
@@ -26,6 +27,8 @@ import grpc
 import torch
 import numpy as np
 from cosyvoice.cli.cosyvoice import CosyVoice
+from batcher import LlmBatcher
+from audio_encoding import AUDIO_FORMATS, AudioEncoder, finalize, iter_encode, to_pcm16
 
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s %(message)s')
@@ -33,31 +36,81 @@ logging.basicConfig(level=logging.DEBUG,
 class CosyVoiceServiceImpl(cosyvoice_pb2_grpc.CosyVoiceServicer):
     def __init__(self, args):
         self.cosyvoice = CosyVoice(args.model_dir)
+        # 并发请求的 LLM 解码由同一个调度线程合批执行
+        self.batcher = LlmBatcher(self.cosyvoice.model, args.max_batch, args.llm_timeout)
+        self.encoder = AudioEncoder()
+        self.sample_rate = getattr(self.cosyvoice, 'sample_rate', 22050)
         logging.info('grpc service initialized')
 
-    def Inference(self, request, context):
+    def synthesize(self, request, stream):
         if request.HasField('sft_request'):
             logging.info('get sft inference request')
-            model_output = self.cosyvoice.inference_sft(request.sft_request.tts_text, request.sft_request.spk_id)
+            return self.cosyvoice.inference_sft(request.sft_request.tts_text, request.sft_request.spk_id, stream=stream)
         elif request.HasField('zero_shot_request'):
             logging.info('get zero_shot inference request')
             prompt_speech_16k = torch.from_numpy(np.array(np.frombuffer(request.zero_shot_request.prompt_audio, dtype=np.int16))).unsqueeze(dim=0)
             prompt_speech_16k = prompt_speech_16k.float() / (2**15)
-            model_output = self.cosyvoice.inference_zero_shot(request.zero_shot_request.tts_text, request.zero_shot_request.prompt_text, prompt_speech_16k)
+            return self.cosyvoice.inference_zero_shot(request.zero_shot_request.tts_text, request.zero_shot_request.prompt_text, prompt_speech_16k, stream=stream)
         elif request.HasField('cross_lingual_request'):
             logging.info('get cross_lingual inference request')
             prompt_speech_16k = torch.from_numpy(np.array(np.frombuffer(request.cross_lingual_request.prompt_audio, dtype=np.int16))).unsqueeze(dim=0)
             prompt_speech_16k = prompt_speech_16k.float() / (2**15)
-            model_output = self.cosyvoice.inference_cross_lingual(request.cross_lingual_request.tts_text, prompt_speech_16k)
+            return self.cosyvoice.inference_cross_lingual(request.cross_lingual_request.tts_text, prompt_speech_16k, stream=stream)
         else:
             logging.info('get instruct inference request')
-            model_output = self.cosyvoice.inference_instruct(request.instruct_request.tts_text, request.instruct_request.spk_id, request.instruct_request.instruct_text)
+            return self.cosyvoice.inference_instruct(request.instruct_request.tts_text, request.instruct_request.spk_id, request.instruct_request.instruct_text, stream=stream)
+
+    def response_format(self, request, context):
+        response_format = (request.response_format or 'pcm').lower()
+        if response_format not in AUDIO_FORMATS:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'unsupported response_format {}'.format(request.response_format))
+        return response_format
 
+    def cache_key(self, request, response_format):
+        # 相同的 (合成模式, 文本, 音色, 格式) 复用编码结果
+        if request.HasField('sft_request'):
+            parts = ('sft', request.sft_request.tts_text, request.sft_request.spk_id)
+        elif request.HasField('zero_shot_request'):
+            parts = ('zero_shot', request.zero_shot_request.tts_text, request.zero_shot_request.prompt_text, request.zero_shot_request.prompt_audio)
+        elif request.HasField('cross_lingual_request'):
+            parts = ('cross_lingual', request.cross_lingual_request.tts_text, request.cross_lingual_request.prompt_audio)
+        else:
+            parts = ('instruct', request.instruct_request.tts_text, request.instruct_request.spk_id, request.instruct_request.instruct_text)
+        return self.encoder.cache.key(response_format, *parts)
+
+    def Inference(self, request, context):
+        response_format = self.response_format(request, context)
+        key = self.cache_key(request, response_format)
+        content = self.encoder.cache.get(key)
+        if content is None:
+            tts_speech = torch.concat([model_output['tts_speech'] for model_output in self.synthesize(request, stream=False)], dim=1)
+            content = self.encoder.submit(to_pcm16(tts_speech), response_format, self.sample_rate).result()
+            self.encoder.cache.put(key, content)
         logging.info('send inference response')
         response = cosyvoice_pb2.Response()
-        response.tts_audio = (model_output['tts_speech'].numpy() * (2 ** 15)).astype(np.int16).tobytes()
+        response.tts_audio = content
         return response
 
+    def InferenceStream(self, request, context):
+        response_format = self.response_format(request, context)
+        key = self.cache_key(request, response_format)
+        content = self.encoder.cache.get(key)
+        if content is not None:
+            response = cosyvoice_pb2.Response()
+            response.tts_audio = content
+            yield response
+            return
+        pcm_chunks = (to_pcm16(model_output['tts_speech']) for model_output in self.synthesize(request, stream=True))
+        chunks = []
+        for chunk in iter_encode(pcm_chunks, response_format, self.sample_rate):
+            chunks.append(chunk)
+            response = cosyvoice_pb2.Response()
+            response.tts_audio = chunk
+            yield response
+        self.encoder.cache.put(key, finalize(b''.join(chunks), response_format))
+        logging.info('send inference stream response')
+
+
 def main():
     grpcServer = grpc.server(futures.ThreadPoolExecutor(max_workers=args.max_conc), maximum_concurrent_rpcs=args.max_conc)
     cosyvoice_pb2_grpc.add_CosyVoiceServicer_to_server(CosyVoiceServiceImpl(args), grpcServer)
@@ -74,7 +127,15 @@ if __name__ == '__main__':
                         default=50000)
     parser.add_argument('--max_conc',
                         type=int,
-                        default=4)
+                        default=16)
+    parser.add_argument('--max_batch',
+                        type=int,
+                        default=16,
+                        help='max number of requests decoded together by the llm')
+    parser.add_argument('--llm_timeout',
+                        type=float,
+                        default=300,
+                        help='seconds a request waits for llm decoding before failing')
     parser.add_argument('--model_dir',
                         type=str,
                         default='iic/CosyVoice-300M',
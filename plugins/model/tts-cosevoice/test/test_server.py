@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+fastapi/server.py 的用例，用假模型代替 CosyVoice，不加载权重。
+
+cd plugins/model/tts-cosevoice && python -m pytest test
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("cosyvoice")
+httpx = pytest.importorskip("httpx")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "fastapi"))
+
+import torch  # noqa: E402
+
+import server  # noqa: E402
+from audio_encoding import AudioCache  # noqa: E402
+
+SAMPLE_RATE = 22050
+# 每句合成耗时与请求超时，四句的总耗时超过超时时间，单句不超过
+SENTENCE_SECONDS = 0.3
+TIMEOUT_SECONDS = 0.5
+# 假模型中跨语种合成单句的最大字数
+SEGMENT_MAX_CHARS = 11
+SENTENCES = ["这是第一句测试文本。", "这是第二句测试文本。", "这是第三句测试文本。", "这是第四句测试文本。"]
+
+
+class FakeFrontend(object):
+    def __init__(self):
+        self.spk2info = {}
+
+    def text_normalize(self, text, split=True):
+        # 与 CosyVoice 类似：规范化补全句末标点后按逗号切分，合并到不超过 SEGMENT_MAX_CHARS 个字。
+        # 补全标点会让文本变长，已规范化的一段再次送入时可能被切成多句
+        text = text if text.endswith("。") else text + "。"
+        if not split:
+            return text
+        segments = []
+        for part in text.split("，"):
+            if segments and len(segments[-1]) + 1 + len(part) <= SEGMENT_MAX_CHARS:
+                segments[-1] += "，" + part
+            else:
+                segments.append(part)
+        return segments
+
+    def frontend_cross_lingual(self, text, prompt_speech_16k, zero_shot_spk_id):
+        # 与 CosyVoice 相同：直接修改 spk2info 中的条目，删除 prompt 文本
+        model_input = self.spk2info[zero_shot_spk_id]
+        model_input["text"] = text
+        del model_input["prompt_text"]
+        return model_input
+
+
+class FakeCosyVoice(object):
+    sample_rate = SAMPLE_RATE
+
+    def __init__(self):
+        self.frontend = FakeFrontend()
+
+    def list_avaliable_spks(self):
+        return ["中文女"]
+
+    def inference_sft(self, text, spk):
+        time.sleep(SENTENCE_SECONDS)
+        yield {"tts_speech": torch.zeros(1, SAMPLE_RATE // 10)}
+
+    def inference_cross_lingual(self, text, prompt_speech_16k, zero_shot_spk_id=""):
+        for segment in self.frontend.text_normalize(text, split=True):
+            self.frontend.frontend_cross_lingual(segment, prompt_speech_16k, zero_shot_spk_id)
+            yield {"tts_speech": torch.zeros(1, len(segment))}
+
+
+def speech(text, stream):
+    async def post():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as client:
+            return await client.post("/v1/audio/speech", json={
+                "model": "cosyvoice", "input": text, "voice": "中文女", "response_format": "pcm", "stream": stream})
+    return asyncio.run(post())
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(server.app, "cosyvoice", FakeCosyVoice(), raising=False)
+    monkeypatch.setattr(server, "pool", server.InferencePool(workers=1, timeout=TIMEOUT_SECONDS))
+    # 关闭编码结果缓存，每个用例都实际合成
+    monkeypatch.setattr(server.encoder, "cache", AudioCache(0))
+
+
+def test_split_sentences():
+    assert server.split_sentences("".join(SENTENCES)) == SENTENCES
+
+
+def test_stream_timeout_applies_per_sentence():
+    # 流式返回时每句单独计时，总耗时超过超时时间也要完整返回所有句子
+    start = time.perf_counter()
+    response = speech("".join(SENTENCES), stream=True)
+    assert response.status_code == 200
+    assert time.perf_counter() - start > TIMEOUT_SECONDS
+    assert len(response.content) == len(SENTENCES) * SAMPLE_RATE // 10 * 2
+    assert server.pool.timeouts == 0
+    assert server.pool.pending == 0
+
+
+def test_non_stream_timeout_applies_to_request():
+    response = speech("".join(SENTENCES), stream=False)
+    assert response.status_code == 504
+    assert server.pool.timeouts > 0
+    assert server.pool.pending == 0
+
+
+def test_cross_lingual_long_segment():
+    # 一整段文本在模型内部被拆成多句，每句都要读到完整的音色条目
+    voice = server.Voice("alice", "prompt", torch.zeros(1, 16000), {"prompt_text": "prompt", "embedding": 1})
+    text = "第一个分句，第二个分句，第三个分句"
+    speech = server.inference_voice(text, voice, mode="cross_lingual")
+    assert speech.shape == (1, len(text))
+    assert server.app.cosyvoice.frontend.spk2info == {}
+    assert voice.spk_info == {"prompt_text": "prompt", "embedding": 1}